@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Benchmark certificate decoding: per certificate '/usr/bin/openssl' vs the in process decoder.
+
+Generates a synthetic 'security find-certificate -a -p -Z' dump and decodes every
+certificate in it with both methods.
+
+    ./benchmarks/bench_certificates.py --count 500
+"""
+import argparse
+import base64
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'processors'))
+
+from munkicon import x509  # NOQA
+
+_SHA256_RSA = bytes.fromhex('2a864886f70d01010b')
+_RSA = bytes.fromhex('2a864886f70d010101')
+_CN = bytes.fromhex('550403')
+_O = bytes.fromhex('55040a')
+_C = bytes.fromhex('550406')
+
+
+def _der(tag, value):
+    """Encode a single DER element."""
+    if len(value) < 0x80:
+        _len = bytes([len(value)])
+    else:
+        _n = (len(value).bit_length() + 7) // 8
+        _len = bytes([0x80 | _n]) + len(value).to_bytes(_n, 'big')
+
+    return bytes([tag]) + _len + value
+
+
+def _name(common_name):
+    _rdns = [(_C, 0x13, b'US'), (_O, 0x0c, b'munkicon benchmarks'), (_CN, 0x0c, common_name.encode())]
+
+    return _der(0x30, b''.join(_der(0x31, _der(0x30, _der(0x06, _oid) + _der(_tag, _val))) for _oid, _tag, _val in _rdns))
+
+
+def der_certificate(index):
+    """A structurally valid (but unsigned) certificate."""
+    _alg = _der(0x30, _der(0x06, _SHA256_RSA) + _der(0x05, b''))
+    _modulus = b'\x00\xc1' + hashlib.sha256(str(index).encode()).digest() * 8
+    _key = _der(0x30, _der(0x02, _modulus) + _der(0x02, b'\x01\x00\x01'))
+    _spki = _der(0x30, _der(0x30, _der(0x06, _RSA) + _der(0x05, b'')) + _der(0x03, b'\x00' + _key))
+    _validity = _der(0x30, _der(0x17, '01{:02d}01000000Z'.format(index % 12 + 1).encode()) + _der(0x18, b'20491231235959Z'))
+    _tbs = _der(0x30, b''.join([_der(0xa0, _der(0x02, b'\x02')),
+                                _der(0x02, (index + 1).to_bytes((index + 1).bit_length() // 8 + 1, 'big')),
+                                _alg,
+                                _name('munkicon Benchmark CA'),
+                                _validity,
+                                _name('munkicon Benchmark {}'.format(index)),
+                                _spki]))
+
+    return _der(0x30, _tbs + _alg + _der(0x03, b'\x00' + hashlib.sha512(_tbs).digest() * 4))
+
+
+def keychain_dump(count):
+    """Synthetic output of 'security find-certificate -a -p -Z'."""
+    result = list()
+
+    for _i in range(count):
+        _der_cert = der_certificate(_i)
+        _b64 = '\n'.join(textwrap.wrap(base64.b64encode(_der_cert).decode(), 64))
+
+        result.append('SHA-256 hash: {}\n'.format(hashlib.sha256(_der_cert).hexdigest().upper()))
+        result.append('SHA-1 hash: {}\n'.format(hashlib.sha1(_der_cert).hexdigest().upper()))
+        result.append('keychain: "/Library/Keychains/System.keychain"\n')
+        result.append('version: 512\n')
+        result.append('-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n'.format(_b64))
+
+    return ''.join(result)
+
+
+def pem_blocks(dump):
+    _end = x509.PEM_END
+
+    return ['{}{}'.format(_c, _end).strip().encode() for _c in dump.split(_end) if 'BEGIN CERTIFICATE' in _c]
+
+
+def decode_openssl(pems, openssl):
+    for _pem in pems:
+        _p = subprocess.run([openssl, 'x509', '-dates', '-subject', '-noout'], input=_pem, capture_output=True)
+
+        if _p.returncode != 0:
+            raise RuntimeError(_p.stderr.decode())
+
+
+def decode_in_process(pems):
+    for _pem in pems:
+        x509.load_pem(_pem)
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--count', type=int, default=500, help='number of certificates to generate')
+    _parser.add_argument('--openssl', default=shutil.which('openssl') or '/usr/bin/openssl', help='openssl binary')
+    _args = _parser.parse_args()
+
+    _pems = pem_blocks(keychain_dump(_args.count))
+    print('certificates: {}'.format(len(_pems)))
+
+    _start = time.perf_counter()
+    decode_in_process(_pems)
+    _in_process = time.perf_counter() - _start
+    print('in process: {:.3f}s ({:.0f} certs/s)'.format(_in_process, len(_pems) / _in_process))
+
+    if os.path.exists(_args.openssl):
+        _start = time.perf_counter()
+        decode_openssl(_pems, _args.openssl)
+        _openssl = time.perf_counter() - _start
+        print('openssl:    {:.3f}s ({:.0f} certs/s)'.format(_openssl, len(_pems) / _openssl))
+        print('speedup:    {:.1f}x'.format(_openssl / _in_process))
+    else:
+        print('openssl:    {} not found, skipped'.format(_args.openssl))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Benchmark munkicon cold start import time with 'python -X importtime'.
+
+Builds the zipapp the same way as 'build.sh' (or uses './src' with '--source src')
+and imports the modules a run needs in a fresh interpreter: the 'processors'
+package and support modules, then each processor on its own, then all processors.
+Reports the minimum and median total import time over a number of runs, and
+the slowest modules imported for all processors.
+
+    ./benchmarks/bench_import.py --runs 10 --top 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+PROCESSORS = ['certificates', 'filevault', 'kext', 'mdm_enrolled', 'pppcp',
+              'profiles', 'python', 'system_extensions', 'system_setup', 'user_accounts']
+
+# Imported by every run before any processors. 'daemon' and 'watch' are only imported in those modes.
+STARTUP = ['processors',
+           'processors.munkicon.backend',
+           'processors.munkicon.cache',
+           'processors.munkicon.executor',
+           'processors.munkicon.logger',
+           'processors.munkicon.metrics',
+           'processors.munkicon.revalidate',
+           'processors.munkicon.timing',
+           'processors.munkicon.worker']
+
+_MARKER = '-- munkicon imports --'
+
+
+def build_zipapp(path):
+    """Build the zipapp as 'build.sh' does."""
+    subprocess.run([sys.executable, '-m', 'zipapp', SRC, '--compress', '--output', path], check=True)
+
+    return path
+
+
+def import_times(target, modules):
+    """Cumulative and self import time in microseconds of each module imported by 'modules'.
+
+    Returns the total import time and a list of (module, self, cumulative, depth)."""
+    _code = '\n'.join(['import importlib, sys',
+                       'sys.path.insert(0, {!r})'.format(target),
+                       'sys.stderr.write({!r} + "\\n")'.format(_MARKER),
+                       'sys.stderr.flush()'] + ['importlib.import_module({!r})'.format(_m) for _m in modules])
+    _p = subprocess.run([sys.executable, '-X', 'importtime', '-c', _code], capture_output=True, encoding='utf-8')
+
+    if _p.returncode != 0:
+        raise RuntimeError(_p.stderr)
+
+    _lines = _p.stderr.split(_MARKER, 1)[1].splitlines()
+    _modules = list()
+    _total = 0
+
+    for _l in _lines:
+        if not _l.startswith('import time:') or 'self [us]' in _l:
+            continue
+
+        _self, _cumulative, _name = _l.replace('import time:', '').split('|')
+        _depth = (len(_name) - len(_name.lstrip()) - 1) // 2
+        _modules.append((_name.strip(), int(_self), int(_cumulative), _depth))
+
+        if _depth == 0:
+            _total += int(_cumulative)
+
+    return _total, _modules
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per scenario')
+    _parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    _parser.add_argument('--source', choices=['zipapp', 'src'], default='zipapp', help='import from a zipapp or ./src')
+    _args = _parser.parse_args()
+
+    _scenarios = [('startup', STARTUP)]
+    _scenarios.extend((_p, STARTUP + ['processors.{}'.format(_p)]) for _p in PROCESSORS)
+    _scenarios.append(('all', STARTUP + ['processors.{}'.format(_p) for _p in PROCESSORS]))
+
+    with tempfile.TemporaryDirectory() as _tmp:
+        _target = build_zipapp(os.path.join(_tmp, 'munkicon')) if _args.source == 'zipapp' else os.path.abspath(SRC)
+
+        print('{:<18}  {:>9}  {:>11}'.format('imports', 'min (ms)', 'median (ms)'))
+
+        for _name, _modules in _scenarios:
+            _totals = [import_times(_target, _modules)[0] for _ in range(_args.runs)]
+
+            print('{:<18}  {:>9.1f}  {:>11.1f}'.format(_name, min(_totals) / 1000, statistics.median(_totals) / 1000))
+
+        _total, _imported = import_times(_target, _scenarios[-1][1])
+
+    print('\nslowest modules (all processors, self time):')
+
+    for _name, _self, _cumulative, _depth in sorted(_imported, key=lambda _x: _x[1], reverse=True)[:_args.top]:
+        print('  {:<40}  {:>7.1f} ms  {:>7.1f} ms cumulative'.format(_name, _self / 1000, _cumulative / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Benchmark the kext processor against synthetic KextPolicy databases.
+
+Compares the previous approach (six queries, a new connection per query and
+per row 'setattr' objects) with the current single read only query.
+
+    ./benchmarks/bench_kext.py --rows 1000 10000 100000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'processors'))
+
+import kext  # NOQA
+
+_SCHEMA = ['CREATE TABLE kext_policy (team_id TEXT, bundle_id TEXT, allowed BOOLEAN, developer_name TEXT, flags INTEGER)',
+           'CREATE TABLE kext_policy_mdm (team_id TEXT, bundle_id TEXT, allowed BOOLEAN, payload_uuid TEXT)']
+
+
+def kext_policy_db(path, rows):
+    """Synthetic KextPolicy database with 'rows' rows split across the user and MDM tables."""
+    _conn = sqlite3.connect(path)
+
+    for _stmt in _SCHEMA:
+        _conn.execute(_stmt)
+
+    _conn.executemany('INSERT INTO kext_policy VALUES (?, ?, 1, ?, 0)',
+                      (('TEAM{:06d}'.format(_i % 5000), 'com.example.kext{}'.format(_i), 'Developer {}'.format(_i % 5000))
+                       for _i in range(rows // 2)))
+    _conn.executemany('INSERT INTO kext_policy_mdm VALUES (?, ?, 1, ?)',
+                      (('TEAM{:06d}'.format(_i % 5000), 'com.example.mdm.kext{}'.format(_i), 'UUID-{}'.format(_i))
+                       for _i in range(rows - rows // 2)))
+    _conn.commit()
+    _conn.close()
+
+
+class LegacyRow(object):
+    def __init__(self, **kwargs):
+        for _k, _v in kwargs.items():
+            setattr(self, _k, _v)
+
+
+def legacy_query(db, q):
+    _cursor = sqlite3.connect(db).cursor()
+    _cursor.execute(q)
+    _columns = [_desc[0] for _desc in _cursor.description]
+
+    return [LegacyRow(**dict(zip(_columns, _r))) for _r in _cursor.fetchall()]
+
+
+def legacy(db):
+    """The previous implementation: each key set queries both tables again."""
+    _mdm_query = 'SELECT team_id, bundle_id, allowed FROM kext_policy_mdm'
+    _usr_query = 'SELECT team_id, bundle_id, allowed FROM kext_policy'
+    result = dict()
+
+    result['kext_teams'] = list({_x.team_id for _x in legacy_query(db, _mdm_query)}.union(
+        {_x.team_id for _x in legacy_query(db, _usr_query)}))
+    result['kext_bundles'] = list({_x.bundle_id for _x in legacy_query(db, _mdm_query)}.union(
+        {_x.bundle_id for _x in legacy_query(db, _usr_query)}))
+    result['kext_team_bundles'] = list({'{},{}'.format(_x.team_id, _x.bundle_id) for _x in legacy_query(db, _mdm_query)}.union(
+        {'{},{}'.format(_x.team_id, _x.bundle_id) for _x in legacy_query(db, _usr_query)}))
+
+    return result
+
+
+def current(db):
+    return kext.KextPolicyConditions(db=db).conditions
+
+
+def timed(func, db):
+    _start = time.perf_counter()
+    _result = func(db)
+
+    return time.perf_counter() - _start, _result
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='number of policy rows')
+    _args = _parser.parse_args()
+
+    print('{:>8}  {:>10}  {:>10}  {:>8}'.format('rows', 'legacy (s)', 'current (s)', 'speedup'))
+
+    with tempfile.TemporaryDirectory() as _tmp:
+        for _rows in _args.rows:
+            _db = os.path.join(_tmp, 'KextPolicy-{}'.format(_rows))
+            kext_policy_db(_db, _rows)
+
+            _legacy, _legacy_result = timed(legacy, _db)
+            _current, _current_result = timed(current, _db)
+
+            if {_k: sorted(_v) for _k, _v in _legacy_result.items()} != _current_result:
+                raise RuntimeError('Legacy and current results differ')
+
+            print('{:>8}  {:>10.3f}  {:>11.3f}  {:>7.1f}x'.format(_rows, _legacy, _current, _legacy / _current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Benchmark de-duplicating condition values: 'if x not in list: append(x)' vs OrderedSet.
+
+Adds n values, where half are duplicates, at increasing sizes. Time per value
+should stay flat for OrderedSet and grow linearly for the list.
+
+    ./benchmarks/bench_ordered_set.py --sizes 1000 5000 10000 20000 40000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'processors'))
+
+from munkicon.orderedset import OrderedSet  # NOQA
+
+
+def values(size):
+    """Condition like strings, each value repeated twice."""
+    return ['{},com.example.app{}'.format('allow', _i // 2) for _i in range(size)]
+
+
+def dedupe_list(vals):
+    result = list()
+
+    for _v in vals:
+        if _v not in result:
+            result.append(_v)
+
+    return result
+
+
+def dedupe_ordered_set(vals):
+    result = OrderedSet()
+
+    for _v in vals:
+        result.add(_v)
+
+    return result
+
+
+def timed(func, vals):
+    _start = time.perf_counter()
+    func(vals)
+
+    return time.perf_counter() - _start
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000, 20000, 40000], help='number of values to add')
+    _args = _parser.parse_args()
+
+    print('{:>8}  {:>12}  {:>12}  {:>14}  {:>14}'.format('values', 'list (s)', 'ordered (s)', 'list (us/val)', 'ordered (us/val)'))
+
+    for _size in _args.sizes:
+        _vals = values(_size)
+        _list = timed(dedupe_list, _vals)
+        _ordered = timed(dedupe_ordered_set, _vals)
+
+        if list(dedupe_ordered_set(_vals)) != dedupe_list(_vals):
+            raise RuntimeError('OrderedSet and list results differ')
+
+        print('{:>8}  {:>12.4f}  {:>12.4f}  {:>14.3f}  {:>14.3f}'.format(_size, _list, _ordered,
+                                                                         _list / _size * 1e6, _ordered / _size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""Benchmark processors against large synthetic inputs.
+
+Generates a synthetic fixture for each processor with a scalable input and runs the
+processor against it with the replay backend, so no Mac is needed:
+
+    certificates       'security find-certificate -a -p -Z' dump with 5k certificates
+    kext               KextPolicy database with 100k rows
+    system_extensions  SystemExtensions 'db.plist' with 10k extensions
+    pppcp              TCC 'MDMOverrides.plist' with 5k payloads
+    profiles           'profiles list -verbose' output with 2k profiles
+    user_accounts      dscl and APFS crypto user data for 1k users
+
+The parsing stage (reading the command output or file into Python objects) is
+timed on its own, and the condition building stage is the rest of the processor's
+run time. Throughput is items per second for the whole run, and peak memory is the
+tracemalloc peak of a separate run. Other processors read small, fixed size
+inputs and aren't included.
+
+    ./benchmarks/bench_scale.py --repeat 5 --json results.json
+    ./benchmarks/bench_scale.py --scale 0.1 --baseline results.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import plistlib
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'processors'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import certificates  # NOQA
+import kext  # NOQA
+import pppcp  # NOQA
+import profiles  # NOQA
+import system_extensions  # NOQA
+import user_accounts  # NOQA
+
+from munkicon import backend  # NOQA
+from munkicon import common  # NOQA
+from munkicon import executor  # NOQA
+from munkicon import plist  # NOQA
+
+from bench_certificates import keychain_dump  # NOQA
+from bench_kext import kext_policy_db  # NOQA
+from processors import VERSION  # NOQA
+
+SECURITY_DUMP = ['/usr/bin/security', 'find-certificate', '-a', '-p', '-Z', '/Library/Keychains/System.keychain']
+PROFILES_LIST = ['/usr/bin/profiles', 'list', '-verbose']
+
+HOST = {'euid': 0, 'uname': ['Darwin', 'munkicon-bench', '23.0.0', 'Darwin Kernel Version 23.0.0', 'arm64']}
+SYSTEM_VERSION = {'ProductVersion': '14.0', 'ProductBuildVersion': '23A344'}
+
+TCC_SERVICES = ['kTCCServiceAccessibility', 'kTCCServiceAddressBook', 'kTCCServiceCalendar', 'kTCCServiceCamera',
+                'kTCCServiceMicrophone', 'kTCCServicePhotos', 'kTCCServiceSystemPolicyAllFiles',
+                'kTCCServiceSystemPolicyDesktopFolder', 'kTCCServiceSystemPolicyDocumentsFolder']
+
+EXTENSION_TYPES = ['com.apple.system_extension.driver_extension',
+                   'com.apple.system_extension.endpoint_security',
+                   'com.apple.system_extension.network_extension']
+
+
+def _command(argv, stdout, stderr=b'', returncode=0):
+    return {'argv': argv, 'stdout': stdout, 'stderr': stderr, 'returncode': returncode, 'duration': 0}
+
+
+def _uuid(index):
+    return str(uuid.UUID(int=index)).upper()
+
+
+def certificates_fixture(count):
+    return {'commands': [_command(SECURITY_DUMP, keychain_dump(count).encode())]}
+
+
+def kext_fixture(count):
+    with tempfile.TemporaryDirectory() as _tmp:
+        _db = os.path.join(_tmp, 'KextPolicy')
+        kext_policy_db(_db, count)
+
+        with open(_db, 'rb') as _f:
+            result = {'files': {kext.INPUTS[0]: _f.read()}}
+
+    return result
+
+
+def system_extensions_fixture(count):
+    _policies = [{'allowedTeamIDs': ['TEAM{:06d}'.format(_i) for _i in range(_p, count, 100)],
+                  'allowedExtensions': {'TEAM{:06d}'.format(_i): ['com.example.policy.ext{}'.format(_i)]
+                                        for _i in range(_p, count, 50)},
+                  'allowedExtensionTypes': {'TEAM{:06d}'.format(_i): [EXTENSION_TYPES[_i % 3]]
+                                            for _i in range(_p, count, 50)}}
+                 for _p in range(10)]
+    _extensions = [{'identifier': 'com.example.ext{}'.format(_i),
+                    'teamID': 'TEAM{:06d}'.format(_i % 1000),
+                    'state': 'activated_enabled' if _i % 10 else 'terminated_waiting_to_uninstall_on_reboot',
+                    'categories': [EXTENSION_TYPES[_i % 3]],
+                    'originPath': '/Applications/Example {}.app'.format(_i),
+                    'uniqueID': _uuid(_i)}
+                   for _i in range(count)]
+
+    return {'files': {system_extensions.INPUTS[0]: plistlib.dumps({'extensionPolicies': _policies,
+                                                                   'extensions': _extensions})}}
+
+
+def pppcp_fixture(count):
+    _overrides = dict()
+
+    for _i in range(count):
+        _payload = {_service: {'Identifier': 'com.example.app{}'.format(_i),
+                               'IdentifierType': 'bundleID',
+                               'Authorization': 'Allow' if _n % 2 else 'AllowStandardUserToSetSystemService'}
+                    for _n, _service in enumerate(TCC_SERVICES[:_i % len(TCC_SERVICES) + 1])}
+        _payload['kTCCServiceAppleEvents'] = {'com.example.app{}'.format(_i): {
+            'Identifier': 'com.example.app{}'.format(_i),
+            'AEReceiverIdentifier': 'com.apple.systemevents',
+            'Allowed': bool(_i % 2)}}
+        _overrides['com.example.app{}'.format(_i)] = _payload
+
+    return {'files': {pppcp.INPUTS[0]: plistlib.dumps(_overrides)}}
+
+
+def profiles_fixture(count):
+    _lines = list()
+
+    for _i in range(count):
+        _prefix = '_computerlevel[{}] attribute: '.format(_i + 1)
+        _lines.extend(['{}name: Example Profile {}'.format(_prefix, _i),
+                       '{}configurationDescription: Synthetic profile {}'.format(_prefix, _i),
+                       '{}installationDate: 2023-01-01 00:00:00 +0000'.format(_prefix),
+                       '{}organization: munkicon benchmarks'.format(_prefix),
+                       '{}profileIdentifier: com.example.profile{}'.format(_prefix, _i),
+                       '{}profileUUID: {}'.format(_prefix, _uuid(_i)),
+                       '{}profileType: Configuration'.format(_prefix)])
+
+    _lines.append('There are {} configuration profiles installed'.format(count))
+
+    return {'commands': [_command(PROFILES_LIST, '\n'.join(_lines).encode())]}
+
+
+def user_accounts_fixture(count):
+    _records = [{'dsAttrTypeStandard:RecordName': ['user{}'.format(_i)],
+                 'dsAttrTypeStandard:NFSHomeDirectory': ['/Users/user{}'.format(_i)],
+                 'dsAttrTypeStandard:GeneratedUID': [_uuid(_i)]}
+                for _i in range(count)]
+    _records.extend({'dsAttrTypeStandard:RecordName': [_name], 'dsAttrTypeStandard:NFSHomeDirectory': ['/var/empty']}
+                    for _name in ['_www', 'daemon', 'nobody', 'root'])
+    _crypto_users = [{'APFSCryptoUserUUID': _uuid(_i),
+                      'APFSCryptoUserType': 'LocalOpenDirectory',
+                      'VolumeOwner': _i % 4 == 0}
+                     for _i in range(0, count, 2)]
+    _crypto_users.append({'APFSCryptoUserUUID': _uuid(count + 1), 'APFSCryptoUserType': 'PersonalRecovery'})
+
+    return {'commands': [_command(user_accounts.DSCL_USERS, plistlib.dumps(_records)),
+                         _command(user_accounts.DISKUTIL_USERS, plistlib.dumps({'Users': _crypto_users}))]}
+
+
+def _parse_certificates():
+    _certs = certificates.Certificate.__new__(certificates.Certificate)
+
+    return list(_certs._certificates())
+
+
+def _parse_kext():
+    return kext.SQLiteDB(db=kext.INPUTS[0]).query(q=kext.QUERY)
+
+
+def _parse_system_extensions():
+    return plist.readPlist(path=backend.path(system_extensions.INPUTS[0]))
+
+
+def _parse_pppcp():
+    return plist.readPlist(path=backend.path(pppcp.INPUTS[0]))
+
+
+def _parse_profiles():
+    return executor.run(PROFILES_LIST).out.splitlines()
+
+
+def _parse_user_accounts():
+    return [plist.readPlistFromString(_p.stdout)
+            for _p in executor.run_all([user_accounts.DSCL_USERS, user_accounts.DISKUTIL_USERS])]
+
+
+# Name: (default number of items, fixture generator, parsing stage, whole run).
+BENCHMARKS = {'certificates': (5000, certificates_fixture, _parse_certificates,
+                               lambda: certificates.Certificate(cache_file=None).conditions),
+              'kext': (100000, kext_fixture, _parse_kext, kext.runner),
+              'system_extensions': (10000, system_extensions_fixture, _parse_system_extensions, system_extensions.runner),
+              'pppcp': (5000, pppcp_fixture, _parse_pppcp, pppcp.runner),
+              'profiles': (2000, profiles_fixture, _parse_profiles, profiles.runner),
+              'user_accounts': (1000, user_accounts_fixture, _parse_user_accounts, user_accounts.runner)}
+
+
+def timed(func, repeat):
+    """Minimum and median seconds taken by 'func' over 'repeat' runs."""
+    _times = list()
+
+    for _ in range(repeat):
+        # Parsed property lists would otherwise be reused between runs.
+        plist.clearCache()
+        gc.collect()
+        _start = time.perf_counter()
+        func()
+        _times.append(time.perf_counter() - _start)
+
+    return min(_times), statistics.median(_times)
+
+
+def peak_memory(func):
+    """Peak bytes allocated by Python while running 'func'."""
+    plist.clearCache()
+    tracemalloc.start()
+
+    try:
+        func()
+        result = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result
+
+
+def benchmark(name, count, repeat, tmp):
+    _, _generate, _parse, _run = BENCHMARKS[name]
+    _fixture = os.path.join(tmp, '{}.zip'.format(name))
+    _data = _generate(count)
+
+    _files = dict(_data.get('files', dict()))
+    _files[common.SYSTEM_VERSION] = plistlib.dumps(SYSTEM_VERSION)
+
+    backend.write_fixture(_fixture, commands=_data.get('commands'), files=_files, host=HOST)
+    backend.replay(_fixture, latency=0)
+
+    _parse_min, _parse_median = timed(_parse, repeat)
+    _total_min, _total_median = timed(_run, repeat)
+
+    result = {'processor': name,
+              'items': count,
+              'parse_seconds': _parse_min,
+              'build_seconds': max(0, _total_min - _parse_min),
+              'total_seconds': _total_min,
+              'total_seconds_median': _total_median,
+              'items_per_second': count / _total_min if _total_min else None,
+              'peak_bytes': peak_memory(_run)}
+
+    return result
+
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """Print the change from a baseline, returning the processors that regressed by more than 'threshold'."""
+    result = list()
+    _baseline = {_r['processor']: _r for _r in baseline.get('results', list())}
+
+    print('\n{:<18}  {:>10}  {:>10}'.format('vs baseline', 'time', 'peak mem'), file=out)
+
+    for _r in results:
+        _b = _baseline.get(_r['processor'])
+
+        if not _b or _b['items'] != _r['items']:
+            print('{:<18}  {:>10}'.format(_r['processor'], 'n/a'), file=out)
+            continue
+
+        _time = _r['total_seconds'] / _b['total_seconds'] - 1
+        _peak = _r['peak_bytes'] / _b['peak_bytes'] - 1 if _b['peak_bytes'] else 0
+        print('{:<18}  {:>+9.1%}  {:>+9.1%}'.format(_r['processor'], _time, _peak), file=out)
+
+        if _time > threshold or _peak > threshold:
+            result.append(_r['processor'])
+
+    return result
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--processors', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                         help='processors to benchmark')
+    _parser.add_argument('--scale', type=float, default=1, help='multiply the number of items generated')
+    _parser.add_argument('--repeat', type=int, default=3, help='runs of each stage, the fastest is reported')
+    _parser.add_argument('--json', metavar='PATH', help="write results as JSON to PATH, or '-' for stdout")
+    _parser.add_argument('--baseline', metavar='PATH', help='JSON results of an earlier run to compare with')
+    _parser.add_argument('--threshold', type=float, default=0.1,
+                         help='exit with status 1 if time or peak memory regress by more than this fraction')
+    _args = _parser.parse_args()
+
+    _results = list()
+    _out = sys.stderr if _args.json == '-' else sys.stdout
+
+    print('{:<18}  {:>8}  {:>9}  {:>9}  {:>9}  {:>11}  {:>9}'.format(
+        'processor', 'items', 'parse (s)', 'build (s)', 'total (s)', 'items/s', 'peak (MB)'), file=_out)
+
+    with tempfile.TemporaryDirectory() as _tmp:
+        for _name in _args.processors:
+            _count = max(1, int(BENCHMARKS[_name][0] * _args.scale))
+            _r = benchmark(_name, _count, max(1, _args.repeat), _tmp)
+            _results.append(_r)
+
+            print('{:<18}  {:>8}  {:>9.3f}  {:>9.3f}  {:>9.3f}  {:>11.0f}  {:>9.1f}'.format(
+                _name, _r['items'], _r['parse_seconds'], _r['build_seconds'], _r['total_seconds'],
+                _r['items_per_second'] or 0, _r['peak_bytes'] / 1048576), file=_out)
+
+    _report = {'munkicon': VERSION,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'machine': platform.machine(),
+               'timestamp': int(time.time()),
+               'scale': _args.scale,
+               'repeat': _args.repeat,
+               'results': _results}
+
+    if _args.json == '-':
+        json.dump(_report, sys.stdout, indent=2)
+        print()
+    elif _args.json:
+        with open(_args.json, 'w') as _f:
+            json.dump(_report, _f, indent=2)
+
+    if _args.baseline:
+        with open(_args.baseline) as _f:
+            _regressed = compare(_results, json.load(_f), _args.threshold, out=_out)
+
+        if _regressed:
+            print('\nRegressed by more than {:.0%}: {}'.format(_args.threshold, ', '.join(_regressed)), file=_out)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,21 @@
 import argparse
+import importlib
 import logging
-import logging.handlers
 import plistlib
+import signal
+import time
 
-from os import geteuid, remove
-from sys import exit, stderr
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from os import _exit, geteuid, remove
+from sys import argv, exit, stderr
 from pathlib import Path
 
 VERSION = '1.0.20211215'
 
+# Seconds all processors have to finish in before last known conditions are used instead.
+DEADLINE = 300
+
 _ARGS = {
     'certificates': {'args': ['--certificates'],
                      'kwargs': {'action': 'store_true',
@@ -71,6 +78,81 @@ def arguments():
     for _k, _arg in _ARGS.items():
         _parser.add_argument(*_arg['args'], **_arg['kwargs'])
 
+    _parser.add_argument('--workers',
+                         dest='workers',
+                         type=int,
+                         required=False,
+                         metavar='[n]',
+                         help='number of processors to run concurrently')
+
+    _parser.add_argument('--daemon',
+                         action='store_true',
+                         dest='daemon',
+                         required=False,
+                         help='keep conditions up to date in the background and serve them to munkicon')
+
+    _parser.add_argument('--watch',
+                         action='store_true',
+                         dest='watch',
+                         required=False,
+                         help='keep running, and re-run processors when their input files change')
+
+    _parser.add_argument('--stale-while-revalidate',
+                         action='store_true',
+                         dest='stale_while_revalidate',
+                         required=False,
+                         help='write last known conditions immediately and refresh them in the background')
+
+    _parser.add_argument('--revalidate',
+                         action='store_true',
+                         dest='revalidate',
+                         required=False,
+                         help=argparse.SUPPRESS)
+
+    _parser.add_argument('--no-cache',
+                         action='store_true',
+                         dest='no_cache',
+                         required=False,
+                         help='ignore cached and daemon conditions and run all selected processors')
+
+    _parser.add_argument('--record',
+                         dest='record',
+                         required=False,
+                         metavar='[path]',
+                         help='record commands run and files read to a fixture archive')
+
+    _parser.add_argument('--replay',
+                         dest='replay',
+                         required=False,
+                         metavar='[path]',
+                         help='run processors against a fixture archive instead of this Mac')
+
+    _parser.add_argument('--replay-latency',
+                         dest='replay_latency',
+                         type=float,
+                         default=1,
+                         required=False,
+                         metavar='[n]',
+                         help='multiply recorded command durations by n when replaying, 0 for no delay')
+
+    _parser.add_argument('--profile',
+                         dest='profile',
+                         required=False,
+                         metavar='[path]',
+                         help='write cProfile stats and peak memory of each processor to a directory')
+
+    _parser.add_argument('--metrics',
+                         dest='metrics',
+                         required=False,
+                         metavar='[path]',
+                         help='write run metrics to a Prometheus textfile, or JSON if path ends in .json')
+
+    _parser.add_argument('--log-json',
+                         action='store_true',
+                         dest='log_json',
+                         required=False,
+                         help='write the log as JSON lines')
+
     _parser.add_argument('--purge',
                          action='store_true',
                          dest='purge',
@@ -92,6 +174,57 @@ def arguments():
     return result
 
 
+class Terminated(Exception):
+    """Raised in the main thread when munkicon receives SIGTERM."""
+
+
+def _sigterm(signum, frame):
+    raise Terminated()
+
+
+def load_processor(name):
+    """Import a processor module by name when it is needed, raising ImportError if there isn't one."""
+    result = importlib.import_module('.{}'.format(name), __name__)
+
+    if not hasattr(result, 'runner'):
+        raise ImportError('{} is not a processor'.format(name))
+
+    return result
+
+
+def processor_attr(name, attr):
+    """A module level attribute of a processor, such as 'INPUTS', or None."""
+    result = None
+
+    try:
+        result = getattr(load_processor(name), attr, None)
+    except ImportError:
+        pass
+
+    return result
+
+
+def run_processor(name, profile_dir=None):
+    """Run a single condition processor and return its conditions, or None if it failed."""
+    from .munkicon import timing  # NOQA
+
+    result = None
+    LOG = logging.getLogger(__name__)
+
+    try:
+        _condition = load_processor(name)
+
+        try:
+            result = timing.run(name, _condition.runner, profile_dir=profile_dir)
+        except Exception as e:
+            # A failed processor has no conditions, and the remaining processors are still written.
+            LOG.error('%s: %s' % (name, e))
+    except ImportError as e:
+        LOG.error('No condition %s found - %s' % (name, e))
+
+    return result
+
+
 def main():
     CONDITIONS_FILE = '/Library/Managed Installs/ConditionalItems.plist'
     PREFS_FILE = '/Library/Preferences/com.github.carlashley.munkicon.plist'
@@ -107,29 +240,39 @@ def main():
                'system_setup',
                'user_accounts']
 
+    # Preferences that are not processor names.
+    SETTINGS = ['command_timeout', 'commands', 'daemon_interval', 'deadline', 'log_backups', 'log_format',
+                'log_max_bytes', 'log_rotate_days', 'metrics_file', 'workers']
+
+    _start = time.monotonic()
     _args = arguments()
 
-    if not geteuid() == 0:
+    # Replayed fixtures don't need root.
+    if not geteuid() == 0 and not _args.replay:
         _msg = 'You must be root to run this tool.'
         print('{}'.format(_msg), file=stderr)
         exit(1)
 
     _process = {_k: _v for _k, _v in _args.__dict__.items() if _k in MODULES}
+    _prefs = dict()
+
+    if Path(PREFS_FILE).exists():
+        with Path(PREFS_FILE).open('rb') as _f:
+            _prefs = plistlib.load(_f)
+
+    from .munkicon import logger  # NOQA
 
     default_log_folder = Path('/Library/Managed Installs/Logs')
     default_log = Path('/Library/Managed Installs/Logs/munkicon.log')
     alt_log = Path('/Library/Logs/munkicon.log')
     log_path = default_log if default_log_folder.exists() else alt_log
-    log = logging.getLogger()
-    log.setLevel(logging.DEBUG)
-    fh = logging.handlers.RotatingFileHandler(log_path, maxBytes=(1048576 * 10), backupCount=7)
-    fmt = logging.Formatter("%(asctime)s - %(name)s -  %(levelname)s - %(message)s")
-    fmt = logging.Formatter(fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    fh.setFormatter(fmt)
-    log.addHandler(fh)
 
-    if log_path.exists() and log_path.stat().st_size > 0:
-        fh.doRollover()
+    # The log is written from a background thread, and rotated by size or age rather than every run.
+    logger.setup(log_path,
+                 format=logger.JSON if _args.log_json else _prefs.get('log_format', logger.TEXT),
+                 max_bytes=_prefs.get('log_max_bytes', logger.MAX_BYTES),
+                 backups=_prefs.get('log_backups', logger.BACKUPS),
+                 rotate_days=_prefs.get('log_rotate_days'))
 
     logging.getLogger(__name__).addHandler(logging.NullHandler())
 
@@ -143,41 +286,291 @@ def main():
             LOG.info('Removed condition file %s' % CONDITIONS_FILE)
             remove(CONDITIONS_FILE)
 
-    # Import the processors after setting up.
-    from . import certificates  # NOQA
-    from . import filevault  # NOQA
-    from . import kext  # NOQA
-    from . import mdm_enrolled  # NOQA
-    from . import pppcp  # NOQA
-    from . import profiles  # NOQA
-    from . import python  # NOQA
-    from . import system_extensions  # NOQA
-    from . import system_setup  # NOQA
-    from . import user_accounts  # NOQA
+    # Import support modules after setting up. Processors are imported as they are run.
+    from .munkicon import backend  # NOQA
+    from .munkicon import cache  # NOQA
+    from .munkicon import executor  # NOQA
+    from .munkicon import metrics  # NOQA
+    from .munkicon import revalidate  # NOQA
+    from .munkicon import timing  # NOQA
+    from .munkicon import worker  # NOQA
 
     LOG.info('Writing conditions to %s' % CONDITIONS_FILE)
 
+    # Every selected processor runs when recording or replaying, and replayed
+    # conditions aren't kept as this Mac's last known conditions.
+    if _args.record:
+        backend.record(_args.record)
+        _args.no_cache = True
+    elif _args.replay:
+        try:
+            backend.replay(_args.replay, latency=_args.replay_latency)
+        except backend.FixtureError as e:
+            LOG.error(e)
+            print('{}'.format(e), file=stderr)
+            exit(1)
+
+        _args.no_cache = True
+
     # If no command line arguments are provided, process a preferences file
     # for processors to run, otherwise presume all processors are to be run.
     if not any([_run for _module, _run in _process.items()]):
-        if Path(PREFS_FILE).exists():
+        if _prefs:
             LOG.info('Processing conditions from preferences %s' % PREFS_FILE)
-            with Path(PREFS_FILE).open('rb') as _f:
-                _process = plistlib.load(_f)
+            _process = {_k: _v for _k, _v in _prefs.items() if _k not in SETTINGS}
         else:
             _process = {_k: True for _k in MODULES}
 
     LOG.debug('Conditions to process: %s' % _process)
 
-    for _module, _run in _process.items():
-        if _run:
-            try:
-                _condition = globals()[_module]
-                try:
-                    _condition.runner(dest=CONDITIONS_FILE)
-                except AttributeError as e:
-                    LOG.error(e)
-                    pass
-            except KeyError as e:
-                LOG.error('No condition %s found' % e)
-                pass
+    # Processors spend most of their time waiting on child processes, so a thread
+    # pool is sufficient. Conditions are merged in processor order once all have
+    # finished, so the result does not depend on the order processors finish in.
+    _workers = max(1, _args.workers or _prefs.get('workers', 1))
+
+    # Memory is traced for the whole process, so profiled processors run one at a time.
+    if _args.profile:
+        _workers = 1
+
+    LOG.debug('Running processors with %s worker(s)' % _workers)
+
+    # Child processes are limited across all processors, whatever the number of workers.
+    executor.set_limit(_prefs.get('commands', executor.DEFAULT_LIMIT))
+    executor.set_timeout(_prefs.get('command_timeout', executor.DEFAULT_TIMEOUT))
+    _deadline = _prefs.get('deadline', DEADLINE) or None
+    _run = [_module for _module, _run in _process.items() if _run]
+
+    # Inputs are fingerprinted before processors first run, so changes made while
+    # they are running are seen.
+    _watcher = None
+
+    if _args.watch:
+        from .munkicon import watch  # NOQA
+
+        _watcher = watch.Watcher({_module: processor_attr(_module, 'INPUTS') for _module in _run})
+        _unwatched = [_module for _module in _run if _module not in _watcher.processors]
+
+        if _unwatched:
+            LOG.info('Not watching processors without input files: %s' % ', '.join(_unwatched))
+
+    if _args.daemon:
+        from .munkicon import daemon  # NOQA
+
+        # Processors with a maximum age are refreshed at least that often.
+        _intervals = {_module: processor_attr(_module, 'MAX_AGE') for _module in _run}
+        _interval = _prefs.get('daemon_interval', daemon.DEFAULT_INTERVAL)
+        _daemon = daemon.Daemon(processors={_module: partial(run_processor, _module) for _module in _run},
+                                intervals={_k: min(_v, _interval) for _k, _v in _intervals.items() if _v},
+                                interval=_interval,
+                                workers=_workers,
+                                watcher=_watcher)
+        signal.signal(signal.SIGTERM, _daemon.shutdown)
+
+        try:
+            _daemon.serve()
+        except (daemon.DaemonError, OSError) as e:
+            LOG.error('Unable to start the munkicon daemon - %s' % e)
+            print('{}'.format(e), file=stderr)
+            exit(1)
+
+        return
+
+    # Metrics of replayed runs aren't written over this Mac's, unless asked for.
+    _metrics_file = _args.metrics or (None if backend.replaying() else _prefs.get('metrics_file', metrics.METRICS_FILE))
+    _children = metrics.children_usage()
+
+    timing.enable()
+    mc = worker.MunkiConWorker(conditions_file=CONDITIONS_FILE)
+    _cache = cache.ResultCache()
+    _results = dict()
+    _timestamps = dict()
+    _snapshot = dict()
+    _statuses = dict()
+
+    if _args.stale_while_revalidate:
+        # Write the last known conditions now and collect fresh conditions in the
+        # background, unless a background refresh is already running.
+        _last = {_module: _cache.last(_module)[0] for _module in _run}
+        _lock = revalidate.refresh_lock()
+
+        if not _lock:
+            LOG.info('Background refresh already running, conditions not updated.')
+            return
+
+        if all(_conditions is not None for _conditions in _last.values()):
+            for _module in _run:
+                mc.update(conditions=_last[_module], log_src=_module)
+
+            mc.write()
+            _lock.close()
+            revalidate.spawn([_arg for _arg in argv[1:] if _arg != '--stale-while-revalidate'])
+            return
+
+        # The first run has nothing to fall back to, so it collects conditions itself.
+        LOG.info('No last known conditions for every processor, collecting conditions now.')
+    elif _args.revalidate:
+        # Held until exiting.
+        _lock = revalidate.refresh_lock()
+
+        if not _lock:
+            LOG.info('Background refresh already running.')
+            return
+
+    # A running daemon already has up to date conditions, so only processors it
+    # doesn't have conditions for are run here.
+    if not _args.no_cache:
+        from .munkicon import daemon  # NOQA
+
+        if Path(daemon.SOCKET_PATH).exists():
+            _response = daemon.fetch(_run) or dict()
+            _snapshot = _response.get('conditions', dict())
+            _timestamps.update(_response.get('timestamps', dict()))
+
+    _pool = ThreadPoolExecutor(max_workers=_workers)
+    _futures = dict()
+    _fingerprints = dict()
+    _terminated = False
+
+    # SIGTERM stops waiting on processors, and conditions collected so far are written.
+    signal.signal(signal.SIGTERM, _sigterm)
+
+    try:
+        for _module in _run:
+            if _module in _snapshot:
+                LOG.info('%s: Using conditions from the munkicon daemon.' % _module)
+                _results[_module] = _snapshot[_module]
+                _statuses[_module] = metrics.DAEMON
+                continue
+
+            # Processors declare the files their conditions depend on, so unchanged
+            # conditions can be reused from a previous run.
+            _inputs = processor_attr(_module, 'INPUTS')
+            _max_age = processor_attr(_module, 'MAX_AGE')
+            _cached = None if _args.no_cache else _cache.get(_module, _inputs, _max_age)
+
+            if _cached is not None:
+                LOG.info('%s: Using cached conditions.' % _module)
+                _results[_module] = _cached
+                _timestamps[_module] = _cache.last(_module)[1]
+                _statuses[_module] = metrics.CACHED
+            else:
+                # Fingerprint before running, so changes made while running invalidate the result.
+                _fingerprints[_module] = cache.fingerprints(_inputs) if _inputs is not None else None
+                _futures[_module] = _pool.submit(run_processor, _module, _args.profile)
+
+        _remaining = max(0, _deadline - (time.monotonic() - _start)) if _deadline else None
+        wait(_futures.values(), timeout=_remaining)
+    except Terminated:
+        LOG.warning('Terminated, writing conditions collected so far.')
+        _terminated = True
+
+    # Nothing below is interrupted part way through.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    for _module, _future in _futures.items():
+        if _future.done():
+            _results[_module] = _future.result()
+            _timestamps[_module] = time.time()
+            _statuses[_module] = metrics.FAILED if _results[_module] is None else metrics.COLLECTED
+
+            if _results[_module] is not None:
+                _cache.put(_module, _fingerprints[_module], _results[_module])
+        elif _terminated:
+            LOG.warning('%s: Did not finish, conditions not updated.' % _module)
+            _statuses[_module] = metrics.UNFINISHED
+        else:
+            _statuses[_module] = metrics.STALE
+
+            # Fall back to the last known conditions, so a hung processor doesn't
+            # leave its conditions missing.
+            _results[_module], _timestamps[_module] = _cache.last(_module)
+
+            if _results[_module] is not None:
+                _when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(_timestamps[_module]))
+                LOG.warning('%s: Did not finish within %ss, using stale conditions from %s.' % (_module, _deadline, _when))
+            else:
+                LOG.warning('%s: Did not finish within %ss, no previous conditions to use.' % (_module, _deadline))
+
+    _pending = [_module for _module, _future in _futures.items() if not _future.done()]
+
+    if _pending:
+        # Stop the commands unfinished processors are waiting on, so they can exit.
+        # Processors that haven't started are cancelled.
+        for _future in _futures.values():
+            _future.cancel()
+
+        _pool.shutdown(wait=False)
+        executor.kill_all()
+    else:
+        _pool.shutdown()
+
+    for _module in _run:
+        mc.update(conditions=_results.get(_module), log_src=_module)
+
+    _write_status = mc.write()
+    backend.save()
+
+    if not backend.replaying():
+        revalidate.write_freshness(_results, _timestamps)
+        _cache.save()
+
+    _report = timing.summary()
+    _duration = time.monotonic() - _start
+
+    if _metrics_file:
+        metrics.write(metrics.collect(_duration, _statuses, _report, _results, _write_status,
+                                      children_before=_children),
+                      path=_metrics_file)
+
+    LOG.info('Finished in %.3fs' % _duration, extra={'seconds': _duration})
+
+    if _watcher and not _terminated:
+        # Only processors with changed inputs are run again, and only their keys are updated.
+        signal.signal(signal.SIGTERM, _watcher.stop)
+        LOG.info('Watching input files of: %s' % ', '.join(_watcher.processors))
+
+        try:
+            for _changed in _watcher.changes():
+                _mc = worker.MunkiConWorker(conditions_file=CONDITIONS_FILE)
+                _changed_start = time.monotonic()
+                _children = metrics.children_usage()
+
+                _changed_results = dict()
+
+                for _module in [_module for _module in _run if _module in _changed]:
+                    _fingerprint = cache.fingerprints(processor_attr(_module, 'INPUTS'))
+                    _changed_results[_module] = run_processor(_module)
+
+                    if _changed_results[_module] is not None:
+                        _cache.put(_module, _fingerprint, _changed_results[_module])
+
+                    _mc.update(conditions=_changed_results[_module], log_src=_module)
+
+                _write_status = _mc.write()
+                revalidate.write_freshness(_changed_results, {_module: time.time() for _module in _changed_results})
+                _cache.save()
+                _report = timing.summary()
+
+                if _metrics_file:
+                    _statuses = {_module: metrics.FAILED if _conditions is None else metrics.COLLECTED
+                                 for _module, _conditions in _changed_results.items()}
+                    metrics.write(metrics.collect(time.monotonic() - _changed_start, _statuses, _report,
+                                                  _changed_results, _write_status, children_before=_children),
+                                  path=_metrics_file)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            _watcher.close()
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _status = 128 + signal.SIGTERM if _terminated else 0
+
+    # Processors stuck somewhere other than a command would otherwise hold up exiting.
+    if _pending and wait([_futures[_module] for _module in _pending], timeout=executor.GRACE).not_done:
+        LOG.warning('Exiting with unfinished processors: %s' % ', '.join(_pending))
+        logger.stop()
+        logging.shutdown()
+        _exit(_status)
+
+    if _status:
+        exit(_status)
@@ -1,12 +1,28 @@
-import re
+import logging
+import os
 import subprocess
 
-from datetime import datetime
-
 try:
-    from munkicon import worker
+    from munkicon import backend
+    from munkicon import common
+    from munkicon import executor
+    from munkicon import plist
+    from munkicon import timing
+    from munkicon import x509
+    from munkicon.orderedset import OrderedSet
 except ImportError:
-    from .munkicon import worker
+    from .munkicon import backend
+    from .munkicon import common
+    from .munkicon import executor
+    from .munkicon import plist
+    from .munkicon import timing
+    from .munkicon import x509
+    from .munkicon.orderedset import OrderedSet
+
+LOG = logging.getLogger(__name__)
+
+# Decoded certificate details, keyed by SHA-256 fingerprint.
+CACHE_FILE = os.path.join(common.CACHE_DIR, 'certificates.plist')
 
 # Keys: 'certificates_sha1'
 #       'certificates_sha1_dates'
@@ -15,128 +31,145 @@ except ImportError:
 #       'certificates_subject'
 #       'certificates_subject_dates'
 
+# Cache conditions until the keychain changes, refreshing at least daily.
+INPUTS = ['/Library/Keychains/System.keychain']
+MAX_AGE = 86400
+
 
 class Certificate():
     """Certificates."""
-    def __init__(self):
-        self.conditions = self._process()
+    def __init__(self, cache_file=CACHE_FILE):
+        # This Mac's certificate cache isn't read or replaced when replaying a fixture.
+        self._cache_file = None if backend.replaying() else cache_file
+        self._cache = self._read_cache()
+        self._seen = dict()
 
-    def _parse_date(self, prefix, val):
-        result = None
-        _timezone = val.strip().split()[-1]
-        _in_fmt = '%b %d %H:%M:%S %Y {}'.format(_timezone)
-        _out_fmt = '%Y-%m-%d %H:%M:%S {}'.format(_timezone)
+        self.conditions = self._process()
 
-        _r = val.replace('{}='.format(prefix), '').strip()
-        _r = datetime.strptime(_r, _in_fmt)
-        _r = datetime.strftime(_r, _out_fmt)
+    @timing.timed
+    def _read_cache(self):
+        """Read previously decoded certificate details."""
+        result = dict()
 
-        result = _r
+        if self._cache_file and os.path.exists(self._cache_file):
+            result = plist.readPlist(path=self._cache_file) or dict()
 
         return result
 
-    def _openssl_expiration(self, cert):
-        """Get notBefore and notAfter dates of certificate using OpenSSL"""
+    @timing.timed
+    def _write_cache(self):
+        """Write details of certificates seen this run; certificates no longer in the keychain are dropped."""
+        if self._cache_file and self._seen != self._cache:
+            try:
+                os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+                plist.writePlist(path=self._cache_file, data=self._seen)
+            except OSError as e:
+                LOG.error('Unable to write certificate cache %s - %s' % (self._cache_file, e))
+
+    def _format_date(self, val):
+        """Format a certificate date as 'YYYY-MM-DD H:M:S TZ'."""
+        return val.strftime('%Y-%m-%d %H:%M:%S GMT')
+
+    def _decode(self, cert):
+        """Get notBefore and notAfter dates and the subject of a PEM certificate."""
         result = {'dates': None, 'subject': None}
-        _bfr_date = None
-        _end_date = None
-
-        # Note, use 'stdin' to 'pipe' certificate through
-        _cmd = ['/usr/bin/openssl', 'x509', '-dates', '-subject', '-noout']
-        _p = subprocess.Popen(_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _p.stdin.write(cert)
-        _r, _e = _p.communicate()
 
-        if _p.returncode == 0 and _r:
-            if isinstance(_r, bytes):
-                _r = _r.decode('utf-8').strip()
+        try:
+            _x509 = x509.load_pem(cert)
+        except x509.X509Error as e:
+            LOG.error('Unable to decode certificate - %s' % e)
+            return result
 
-            for _l in _r.splitlines():
-                _l = re.sub('\s+', ' ', _l)
+        result['subject'] = _x509.subject
+        result['dates'] = '{} to {}'.format(self._format_date(_x509.not_before), self._format_date(_x509.not_after))
 
-                # Convert the time details to a YYYY-MM-DD H:M:S TZ
-                # format
-                if 'notBefore' in _l:
-                    _bfr_date = self._parse_date(prefix='notBefore', val=_l)
+        return result
 
-                if 'notAfter' in _l:
-                    _end_date = self._parse_date(prefix='notAfter', val=_l)
+    def _cached_decode(self, sha256, cert):
+        """Decode a certificate, using cached details if the SHA-256 fingerprint has been seen before."""
+        result = self._cache.get(sha256) if sha256 else None
 
-                if 'subject' in _l:
-                    result['subject'] = _l.replace('subject= ', '')
+        if not result:
+            result = self._decode(cert=cert)
 
-            if _bfr_date and _end_date:
-                result['dates'] = '{} to {}'.format(_bfr_date, _end_date)
+        # Only cache certificates that decoded successfully.
+        if sha256 and result['dates'] and result['subject']:
+            self._seen[sha256] = result
 
         return result
 
-    def _find_certificates(self):
-        """Find certificates and process dates.."""
-        result = {'certificates_sha1': list(),
-                  'certificates_sha1_dates': list(),
-                  'certificates_sha256': list(),
-                  'certificates_sha256_dates': list(),
-                  'certificates_subject': list(),
-                  'certificates_subject_dates': list()}
+    def _certificates(self, keychain='/Library/Keychains/System.keychain'):
+        """Yield (sha1, sha256, pem) of each certificate in a keychain as 'security' outputs it."""
+        _begin_cert_str = '-----BEGIN CERTIFICATE-----'
         _end_cert_str = '-----END CERTIFICATE-----'
         _sha1_prefix = 'SHA-1 hash: '
         _sha256_prefix = 'SHA-256 hash: '
+        _sha1 = None
+        _sha256 = None
+        _pem = None
+
+        _cmd = ['/usr/bin/security', 'find-certificate', '-a', '-p', '-Z', keychain]
+
+        with executor.popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as _p, executor.watchdog(_p):
+            for _l in _p.stdout:
+                _l = _l.decode('utf-8').strip()
+
+                if _pem is not None:
+                    _pem.append(_l)
+
+                    if _end_cert_str in _l:
+                        yield _sha1, _sha256, '\n'.join(_pem).encode()
+
+                        _sha1 = None
+                        _sha256 = None
+                        _pem = None
+                elif _begin_cert_str in _l:
+                    _pem = [_l]
+                elif _sha1_prefix in _l:
+                    _sha1 = _l.replace(_sha1_prefix, '')
+                elif _sha256_prefix in _l:
+                    _sha256 = _l.replace(_sha256_prefix, '')
+
+            if _sha1 or _sha256:
+                yield _sha1, _sha256, None
+
+        # Certificates can't be trusted if 'security' failed part way through, and
+        # raising means neither they nor the decoded certificate details are cached.
+        if _p.returncode != 0:
+            raise executor.CommandError(executor.CommandResult(cmd=_cmd, returncode=_p.returncode,
+                                                               stdout=None, stderr=None))
+
+    @timing.timed
+    def _find_certificates(self):
+        """Find certificates and process dates.."""
+        result = {'certificates_sha1': OrderedSet(),
+                  'certificates_sha1_dates': OrderedSet(),
+                  'certificates_sha256': OrderedSet(),
+                  'certificates_sha256_dates': OrderedSet(),
+                  'certificates_subject': OrderedSet(),
+                  'certificates_subject_dates': OrderedSet()}
 
-        _cmd = ['/usr/bin/security', 'find-certificate', '-a', '-p', '-Z', '/Library/Keychains/System.keychain']
-
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
-
-        if _p.returncode == 0 and _r:
-            if isinstance(_r, bytes):
-                _r = _r.decode('utf-8').strip()
-
-            for _cert in _r.split(_end_cert_str):
-                _sha1 = None
-                _sha256 = None
-
-                for _l in _cert.splitlines():
-                    if _sha1_prefix in _l:
-                        _sha1 = _l
-                    elif _sha256_prefix in _l:
-                        _sha256 = _l
-
-                if _sha1:
-                    _sha1 = _sha1.replace(_sha1_prefix, '')
-
-                    if _sha1 not in result['certificates_sha1']:
-                        result['certificates_sha1'].append(_sha1)
-
-                if _sha256:
-                    _sha256 = _sha256.replace(_sha256_prefix, '')
-
-                    if _sha256 not in result['certificates_sha256']:
-                        result['certificates_sha256'].append(_sha256)
-
-                if 'BEGIN CERTIFICATE' in _cert:
-                    _cert = str('{}{}'.format(_cert, _end_cert_str).strip()).encode()
-                    _decoded = self._openssl_expiration(cert=_cert)
-                    _dates = _decoded['dates']
-                    _subject = _decoded['subject']
-
-                    if (_sha1, _sha256, _dates):
-                        _sha1_result = '{},{}'.format(_sha1, _dates)
-                        _sha256_result = '{},{}'.format(_sha256, _dates)
+        for _sha1, _sha256, _cert in self._certificates():
+            if _sha1:
+                result['certificates_sha1'].add(_sha1)
 
-                        if _sha1_result not in result['certificates_sha1_dates']:
-                            result['certificates_sha1_dates'].append(_sha1_result)
+            if _sha256:
+                result['certificates_sha256'].add(_sha256)
 
-                        if _sha256_result not in result['certificates_sha256_dates']:
-                            result['certificates_sha256_dates'].append(_sha256_result)
+            if _cert:
+                _decoded = self._cached_decode(sha256=_sha256, cert=_cert)
+                _dates = _decoded['dates']
+                _subject = _decoded['subject']
 
-                    if _subject and _subject not in result['certificates_subject']:
-                        result['certificates_subject'].append(_subject)
+                if (_sha1, _sha256, _dates):
+                    result['certificates_sha1_dates'].add('{},{}'.format(_sha1, _dates))
+                    result['certificates_sha256_dates'].add('{},{}'.format(_sha256, _dates))
 
-                    if _subject and _dates:
-                        _subj_dates = '{},{}'.format(_subject, _dates)
+                if _subject:
+                    result['certificates_subject'].add(_subject)
 
-                        if _subj_dates not in result['certificates_subject_dates']:
-                            result['certificates_subject_dates'].append(_subj_dates)
+                if _subject and _dates:
+                    result['certificates_subject_dates'].add('{},{}'.format(_subject, _dates))
 
         return result
 
@@ -145,12 +178,12 @@ class Certificate():
         result = dict()
 
         result.update(self._find_certificates())
+        self._write_cache()
 
         return result
 
 
-def runner(dest):
+def runner():
     certs = Certificate()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=certs.conditions)
+    return certs.conditions
@@ -1,11 +1,13 @@
-import os
-import subprocess
 import sys
 
 try:
-    from munkicon import worker
+    from munkicon import backend
+    from munkicon import executor
+    from munkicon import timing
 except ImportError:
-    from .munkicon import worker
+    from .munkicon import backend
+    from .munkicon import executor
+    from .munkicon import timing
 
 # Keys: 'filevault_active'
 #       'filevault_deferral'
@@ -17,33 +19,37 @@ except ImportError:
 #       'filevault_decryption_in_progress'
 #       'filevault_users'
 
+# Conditions come from 'fdesetup' only, so are never cached.
+INPUTS = None
+MAX_AGE = None
+
+VERBS = ['status', 'isactive', 'list', 'showdeferralinfo', 'haspersonalrecoverykey', 'hasinstitutionalrecoverykey']
+
 
 class FileVaultConditions(object):
     """FileVault conditions."""
     def __init__(self):
+        self._commands = None
         self.conditions = self._process()
 
     def _fdesetup(self, verb):
         """Executes the `fdesetup` command and processes output."""
         result = None
 
-        if os.geteuid() == 0:
+        if backend.geteuid() == 0:
             _cmd = ['/usr/bin/fdesetup', verb]
 
-            _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            _r, _e = _p.communicate()
+            _p = self._commands.run(_cmd) if self._commands else executor.run(_cmd)
 
             if _p.returncode == 0 or (verb == 'showdeferralinfo' and _p.returncode == 20):
-                if _r:
-                    if isinstance(_r, bytes):
-                        _r = _r.decode('utf-8').strip()
-
-                    result = _r
+                if _p.out:
+                    result = _p.out
         else:
             sys.exit(1)
 
         return result
 
+    @timing.timed
     def _status(self):
         """FileVault Status."""
         result = {'filevault_status': '',
@@ -64,6 +70,7 @@ class FileVaultConditions(object):
 
         return result
 
+    @timing.timed
     def _is_active(self):
         """FileVault on and active. Differs to 'status'."""
         result = {'filevault_active': ''}
@@ -75,6 +82,7 @@ class FileVaultConditions(object):
 
         return result
 
+    @timing.timed
     def _users(self):
         """FileVault Users."""
         result = {'filevault_users': ''}
@@ -87,6 +95,7 @@ class FileVaultConditions(object):
 
         return result
 
+    @timing.timed
     def _deferral_info(self):
         """Deferrals"""
         result = {'filevault_deferral': ''}
@@ -102,6 +111,7 @@ class FileVaultConditions(object):
 
         return result
 
+    @timing.timed
     def _has_personal_key(self):
         """Personal recovery key."""
         result = {'filevault_personal_key': ''}
@@ -110,6 +120,7 @@ class FileVaultConditions(object):
 
         return result
 
+    @timing.timed
     def _has_institution_key(self):
         """Personal recovery key."""
         result = {'filevault_institution_key': ''}
@@ -122,6 +133,10 @@ class FileVaultConditions(object):
         """Process all conditions and generate the condition dictionary."""
         result = dict()
 
+        # The verbs are independent, so run them all at once.
+        if backend.geteuid() == 0:
+            self._commands = executor.Batch([['/usr/bin/fdesetup', _verb] for _verb in VERBS])
+
         result.update(self._status())
         result.update(self._is_active())
         result.update(self._users())
@@ -132,8 +147,7 @@ class FileVaultConditions(object):
         return result
 
 
-def runner(dest):
+def runner():
     fde = FileVaultConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=fde.conditions)
+    return fde.conditions
@@ -1,103 +1,98 @@
 import os
 import sqlite3
 
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import quote
+
 try:
-    from munkicon import worker
+    from munkicon import backend
+    from munkicon import timing
 except ImportError:
-    from .munkicon import worker
+    from .munkicon import backend
+    from .munkicon import timing
 
 # Keys: 'kext_teams'
 #       'kext_bundles'
 #       'kext_team_bundle'
 
+# Cache conditions until the policy database changes.
+INPUTS = ['/var/db/SystemPolicyConfiguration/KextPolicy',
+          '/var/db/SystemPolicyConfiguration/KextPolicy-wal']
+MAX_AGE = None
+
+# Both MDM and user approved policies are read in a single query.
+QUERY = ('SELECT team_id, bundle_id, allowed FROM kext_policy_mdm '
+         'UNION ALL '
+         'SELECT team_id, bundle_id, allowed FROM kext_policy')
+
 
 class SQLiteDB():
     """SQLite"""
     def __init__(self, db='/var/db/SystemPolicyConfiguration/KextPolicy'):
         self._db = db
-        self._connection = None
-
-        self.cursor = None
 
-    def _connect(self):
-        """Connect."""
-        self._connection = sqlite3.connect(self._db)
-
-        self.cursor = self._connection.cursor()
-
-    def _disconnect(self):
-        """Disconnect."""
-        self._connection.close()
+    def _uri(self):
+        """Read only URI."""
+        # Readers of a database in WAL mode don't block syspolicyd writing to it, but need
+        # its shared memory index, so file locking is left on.
+        return 'file:{}?mode=ro'.format(quote(backend.path(self._db)))
 
     def query(self, q):
         """Query. Fetch all."""
         result = None
 
-        if os.path.exists(self._db):
-            self._connect()
+        if os.path.exists(backend.path(self._db)):
+            _connection = sqlite3.connect(self._uri(), uri=True)
 
             try:
-                self.cursor.execute(q)
-
-                _columns = [_desc[0] for _desc in self.cursor.description]
-                _rows = list()
-
-                for _r in self.cursor.fetchall():
-                    _row = {_key: _value for _key, _value in zip(_columns, _r)}
+                _cursor = _connection.execute(q)
+                _row = self.Row(tuple(_desc[0] for _desc in _cursor.description))
 
-                    _rows.append(self.Row(**_row))
+                result = [_row._make(_r) for _r in _cursor.fetchall()]
+            finally:
+                _connection.close()
 
-                result = _rows
-            except Exception:
-                self._disconnect()
-                raise
         return result
 
-    class Row(object):
-        def __init__(self, **kwargs):
-            for _k, _v in kwargs.items():
-                setattr(self, _k, _v)
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def Row(columns):
+        """Fixed field row type for the given columns."""
+        return namedtuple('Row', columns)
 
 
 class KextPolicyConditions(object):
     """Whitelisted KEXT's as applied by MDM or set by user."""
-    def __init__(self):
-        self._mdm_query = 'SELECT team_id, bundle_id, allowed FROM kext_policy_mdm'
-        self._usr_query = 'SELECT team_id, bundle_id, allowed FROM kext_policy'
-        self._db = SQLiteDB()
+    def __init__(self, db='/var/db/SystemPolicyConfiguration/KextPolicy'):
+        self._query = QUERY
+        self._db = SQLiteDB(db=db)
 
         self.conditions = self._process()
 
-    def _teams(self):
-        """Team ID's"""
-        result = {'kext_teams': list()}
-
-        _mdm = {_x.team_id for _x in self._db.query(q=self._mdm_query)}
-        _usr = {_x.team_id for _x in self._db.query(q=self._usr_query)}
-
-        result['kext_teams'] = list(_mdm.union(_usr))
-
-        return result
-
-    def _bundles(self):
-        """Bundle ID's"""
-        result = {'kext_bundles': list()}
+    @timing.timed
+    def _policies(self):
+        """Team ID's, Bundle ID's and Team & Bundle ID's"""
+        result = {'kext_teams': list(),
+                  'kext_bundles': list(),
+                  'kext_team_bundles': list()}
 
-        _mdm = {_x.bundle_id for _x in self._db.query(q=self._mdm_query)}
-        _usr = {_x.bundle_id for _x in self._db.query(q=self._usr_query)}
+        _teams = set()
+        _bundles = set()
+        _team_bundles = set()
 
-        result['kext_bundles'] = list(_mdm.union(_usr))
-
-        return result
+        for _x in self._db.query(q=self._query) or list():
+            if _x.team_id:
+                _teams.add(_x.team_id)
 
-    def _team_bundles(self):
-        """Team & Bundle ID's"""
-        result = {'kext_bundles': list()}
+            if _x.bundle_id:
+                _bundles.add(_x.bundle_id)
 
-        _mdm = {'{},{}'.format(_x.team_id, _x.bundle_id) for _x in self._db.query(q=self._mdm_query)}
-        _usr = {'{},{}'.format(_x.team_id, _x.bundle_id) for _x in self._db.query(q=self._usr_query)}
+            _team_bundles.add('{},{}'.format(_x.team_id, _x.bundle_id))
 
-        result['kext_team_bundles'] = list(_mdm.union(_usr))
+        result['kext_teams'] = sorted(_teams)
+        result['kext_bundles'] = sorted(_bundles)
+        result['kext_team_bundles'] = sorted(_team_bundles)
 
         return result
 
@@ -105,15 +100,12 @@ class KextPolicyConditions(object):
         """Process all conditions and generate the condition dictionary."""
         result = dict()
 
-        result.update(self._teams())
-        result.update(self._bundles())
-        result.update(self._team_bundles())
+        result.update(self._policies())
 
         return result
 
 
-def runner(dest):
+def runner():
     kext = KextPolicyConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=kext.conditions)
+    return kext.conditions
@@ -1,32 +1,33 @@
-import subprocess
-
 try:
-    from munkicon import worker
+    from munkicon import executor
+    from munkicon import timing
 except ImportError:
-    from .munkicon import worker
+    from .munkicon import executor
+    from .munkicon import timing
 
 # Keys: 'enrolled_via_dep'
 #       'mdm_enrollment'
 
+# Conditions come from 'profiles' only, so are never cached.
+INPUTS = None
+MAX_AGE = None
+
 
 class MDMEnrolledConditions(object):
     def __init__(self):
         self.conditions = self._process()
 
+    @timing.timed
     def _enrolled_state(self):
         """MDM/DEP Enrolled State."""
         result = {'enrolled_via_dep': '',
                   'mdm_enrollment': ''}
 
         _cmd = ['/usr/bin/profiles', 'status', '-type', 'enrollment']
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
+        _p = executor.run(_cmd)
 
         if _p.returncode == 0:
-            if isinstance(_r, bytes):
-                _r = _r.decode('utf-8').strip()
-
-            for _l in _r.splitlines():
+            for _l in _p.out.splitlines():
                 _l = _l.strip()
 
                 if 'DEP' in _l:
@@ -46,8 +47,7 @@ class MDMEnrolledConditions(object):
         return result
 
 
-def runner(dest):
+def runner():
     mdm = MDMEnrolledConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=mdm.conditions)
+    return mdm.conditions
@@ -0,0 +1,349 @@
+"""Record and replay of the commands and files processors read."""
+import atexit
+import io
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+
+from collections import defaultdict
+from urllib.parse import quote
+
+try:
+    import plist
+except ImportError:
+    from . import plist
+
+LOG = logging.getLogger(__name__)
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+FIXTURE_VERSION = 1
+MANIFEST = 'fixture.plist'
+FILES_DIR = 'files'
+
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+_MODE = None
+_FIXTURE = None
+_LATENCY = 1
+_ROOT = None
+_HOST = dict()
+_COMMANDS = list()
+_REPLAYS = defaultdict(list)
+_REPLAYED = defaultdict(int)
+_FILES = dict()
+_EXISTS = dict()
+_LINKS = dict()
+_REALPATHS = dict()
+_LOCK = threading.Lock()
+
+
+class FixtureError(Exception):
+    """A fixture archive can't be read."""
+
+
+def mode():
+    """RECORD, REPLAY, or None when commands are run and files read as usual."""
+    return _MODE
+
+
+def recording():
+    return _MODE == RECORD
+
+
+def replaying():
+    return _MODE == REPLAY
+
+
+def _key(cmd, input=None):
+    return (tuple(cmd), input or b'')
+
+
+def _member(path):
+    """Archive member name of a recorded file."""
+    return '{}/{}'.format(FILES_DIR, os.path.abspath(path).lstrip('/'))
+
+
+def record(fixture):
+    """Start recording commands and files read, to be saved to 'fixture' by save()."""
+    global _MODE, _FIXTURE, _HOST
+
+    _MODE = RECORD
+    _FIXTURE = fixture
+    _HOST = {'euid': os.geteuid(), 'uname': list(os.uname())}
+
+    LOG.info('Recording commands and files to %s' % fixture)
+
+
+def replay(fixture, latency=1):
+    """Serve commands and files from 'fixture', with command durations scaled by 'latency'."""
+    global _MODE, _FIXTURE, _LATENCY, _ROOT, _HOST
+
+    try:
+        with zipfile.ZipFile(fixture) as _zip:
+            _manifest = plist.readPlistFromString(_zip.read(MANIFEST))
+
+            _tmp_dir = tempfile.mkdtemp(prefix='munkicon-replay.')
+            atexit.register(shutil.rmtree, _tmp_dir, True)
+            _zip.extractall(_tmp_dir, [_m for _m in _zip.namelist() if _m.startswith(FILES_DIR + '/')])
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        raise FixtureError('Unable to read fixture {} - {}'.format(fixture, e))
+
+    if _manifest.get('version') != FIXTURE_VERSION:
+        raise FixtureError('Unsupported fixture version {}'.format(_manifest.get('version')))
+
+    with _LOCK:
+        _REPLAYS.clear()
+        _REPLAYED.clear()
+
+        for _entry in _manifest.get('commands', list()):
+            _REPLAYS[_key(_entry['argv'], _entry.get('input'))].append(_entry)
+
+        _EXISTS.clear()
+        _EXISTS.update(_manifest.get('exists', dict()))
+        _LINKS.clear()
+        _LINKS.update(_manifest.get('links', dict()))
+        _REALPATHS.clear()
+        _REALPATHS.update(_manifest.get('realpaths', dict()))
+
+    _MODE = REPLAY
+    _FIXTURE = fixture
+    _LATENCY = max(0, latency)
+    _ROOT = os.path.join(_tmp_dir, FILES_DIR)
+    _HOST = _manifest.get('host', dict())
+
+    LOG.info('Replaying %s commands from %s' % (len(_manifest.get('commands', list())), fixture))
+
+
+def write_fixture(fixture, commands=None, files=None, host=None, exists=None, links=None, realpaths=None):
+    """Write a fixture archive of command dictionaries and file contents keyed by path."""
+    _manifest = {'version': FIXTURE_VERSION,
+                 'host': host or dict(),
+                 'commands': list(commands or list()),
+                 'exists': dict(exists or dict()),
+                 'links': dict(links or dict()),
+                 'realpaths': dict(realpaths or dict())}
+
+    with zipfile.ZipFile(fixture, 'w', compression=zipfile.ZIP_DEFLATED) as _zip:
+        _zip.writestr(MANIFEST, plist.writePlistToString(_manifest, binary=True))
+
+        for _path, _data in sorted((files or dict()).items()):
+            _zip.writestr(_member(_path), _data)
+
+
+def save():
+    """Write everything recorded to the fixture archive."""
+    if not recording():
+        return
+
+    with _LOCK:
+        _commands = list(_COMMANDS)
+        _files = dict(_FILES)
+        _exists = dict(_EXISTS)
+        _links = dict(_LINKS)
+        _realpaths = dict(_REALPATHS)
+
+    write_fixture(_FIXTURE, commands=_commands, files=_files, host=_HOST, exists=_exists, links=_links,
+                  realpaths=_realpaths)
+
+    LOG.info('Recorded %s commands and %s files to %s' % (len(_commands), len(_files), _FIXTURE))
+
+
+def add_command(result, input=None, duration=0):
+    """Record a CommandResult (munkicon.executor) that took 'duration' seconds."""
+    if not recording():
+        return
+
+    _entry = {'argv': list(result.cmd),
+              'returncode': result.returncode,
+              'stdout': result.stdout or b'',
+              'stderr': result.stderr or b'',
+              'duration': duration,
+              'timed_out': result.timed_out}
+
+    if input:
+        _entry['input'] = input
+
+    with _LOCK:
+        _COMMANDS.append(_entry)
+
+
+def command(cmd, input=None):
+    """Recorded entry of a command, or None if it wasn't recorded."""
+    result = None
+    _k = _key(cmd, input)
+
+    with _LOCK:
+        _entries = _REPLAYS.get(_k)
+
+        if _entries:
+            result = _entries[min(_REPLAYED[_k], len(_entries) - 1)]
+            _REPLAYED[_k] += 1
+
+    if result is None:
+        LOG.warning('%s was not recorded in %s' % (cmd, _FIXTURE))
+    elif _LATENCY:
+        time.sleep(result.get('duration', 0) * _LATENCY)
+
+    return result
+
+
+def _snapshot(path):
+    """Contents of a file, with SQLite databases copied consistently including their write-ahead log."""
+    with open(path, 'rb') as _f:
+        result = _f.read()
+
+    if result.startswith(_SQLITE_HEADER):
+        _fd, _tmp_path = tempfile.mkstemp(prefix='munkicon-record.')
+        os.close(_fd)
+
+        try:
+            _src = sqlite3.connect('file:{}?mode=ro'.format(quote(path)), uri=True)
+            _dst = sqlite3.connect(_tmp_path)
+
+            try:
+                _src.backup(_dst)
+
+                # A single file that can be read without its write-ahead log.
+                _dst.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                _dst.close()
+                _src.close()
+
+            with open(_tmp_path, 'rb') as _f:
+                result = _f.read()
+        finally:
+            os.remove(_tmp_path)
+
+    return result
+
+
+def _replay_path(path):
+    return os.path.join(_ROOT, os.path.abspath(path).lstrip('/'))
+
+
+def path(path):
+    """Where to read a file from. Files that exist are recorded the first time they are read."""
+    result = path
+
+    if replaying():
+        result = _replay_path(path)
+    elif recording() and path not in _FILES and os.path.isfile(path):
+        try:
+            _data = _snapshot(path)
+
+            with _LOCK:
+                _FILES[path] = _data
+        except (OSError, sqlite3.Error) as e:
+            LOG.debug('Unable to record %s - %s' % (path, e))
+
+    return result
+
+
+def exists(path):
+    """Whether a path exists, for paths whose contents aren't read."""
+    if replaying():
+        result = _EXISTS.get(path)
+
+        if result is None:
+            result = os.path.exists(_replay_path(path))
+    else:
+        result = os.path.exists(path)
+
+        if recording():
+            with _LOCK:
+                _EXISTS[path] = result
+
+    return result
+
+
+def readlink(path):
+    """Target of a symbolic link. Raises OSError if it isn't one."""
+    if replaying():
+        if path not in _LINKS:
+            raise OSError('{} is not a recorded link'.format(path))
+
+        result = _LINKS[path]
+    else:
+        result = os.readlink(path)
+
+        if recording():
+            with _LOCK:
+                _LINKS[path] = result
+
+    return result
+
+
+def realpath(path):
+    """Canonical path with symbolic links resolved."""
+    if replaying():
+        result = _REALPATHS.get(path, path)
+    else:
+        result = os.path.realpath(path)
+
+        if recording():
+            with _LOCK:
+                _REALPATHS[path] = result
+
+    return result
+
+
+def geteuid():
+    """Effective user ID, as recorded when replaying."""
+    result = os.geteuid()
+
+    if replaying() and 'euid' in _HOST:
+        result = _HOST['euid']
+
+    return result
+
+
+def uname():
+    """os.uname() of this Mac, as recorded when replaying."""
+    result = os.uname()
+
+    if replaying() and 'uname' in _HOST:
+        result = os.uname_result(_HOST['uname'])
+
+    return result
+
+
+class Process(object):
+    """Stands in for subprocess.Popen, serving the output of a command that has already finished."""
+    def __init__(self, result, stdout=None, stderr=None, **kwargs):
+        self.args = result.cmd
+        self.returncode = result.returncode
+        self.stdout = io.BytesIO(result.stdout or b'') if stdout == subprocess.PIPE else None
+        self.stderr = io.BytesIO(result.stderr or b'') if stderr == subprocess.PIPE else None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def communicate(self, input=None, timeout=None):
+        result = (self.stdout.read() if self.stdout else None, self.stderr.read() if self.stderr else None)
+
+        return result
+
+    def terminate(self):
+        pass
+
+    def kill(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        for _stream in (self.stdout, self.stderr):
+            if _stream:
+                _stream.close()
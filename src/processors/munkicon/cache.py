@@ -0,0 +1,91 @@
+"""Persistent cache of processor conditions."""
+import logging
+import os
+import threading
+import time
+
+try:
+    import common
+    import plist
+except ImportError:
+    from . import common
+    from . import plist
+
+LOG = logging.getLogger(__name__)
+
+CACHE_FILE = os.path.join(common.CACHE_DIR, 'conditions.plist')
+
+
+def fingerprints(inputs):
+    """Fingerprint of each input file as a string, empty if it is missing."""
+    result = dict()
+
+    for _path in inputs or list():
+        _fingerprint = plist.fingerprint(_path)
+        result[_path] = ':'.join(str(_x) for _x in _fingerprint) if _fingerprint else ''
+
+    return result
+
+
+class ResultCache(object):
+    """Conditions of each processor from previous runs."""
+    def __init__(self, path=CACHE_FILE):
+        self._path = path
+        self._entries = dict()
+        self._changed = False
+        self._lock = threading.Lock()
+
+        if self._path and os.path.exists(self._path):
+            self._entries = plist.readPlist(path=self._path) or dict()
+
+    def get(self, name, inputs, max_age=None):
+        """Cached conditions for a processor, or None if there are none or they are out of date."""
+        result = None
+        _entry = self._entries.get(name)
+
+        if inputs is not None and _entry and _entry.get('inputs') is not None:
+            _age = time.time() - _entry.get('timestamp', 0)
+
+            if _entry.get('inputs') != fingerprints(inputs):
+                LOG.debug('%s: Inputs changed since conditions were cached.' % name)
+            elif max_age is not None and not 0 <= _age < max_age:
+                LOG.debug('%s: Cached conditions are older than %ss.' % (name, max_age))
+            else:
+                result = _entry.get('conditions')
+
+        return result
+
+    def last(self, name):
+        """Last known conditions for a processor regardless of age, and when they were cached."""
+        result = (None, None)
+        _entry = self._entries.get(name)
+
+        if _entry:
+            result = (_entry.get('conditions'), _entry.get('timestamp'))
+
+        return result
+
+    def put(self, name, input_fingerprints, conditions):
+        """Cache a processor's conditions along with the input fingerprints taken before it ran."""
+        with self._lock:
+            self._entries[name] = {'timestamp': time.time(),
+                                   'conditions': conditions}
+
+            if input_fingerprints is not None:
+                self._entries[name]['inputs'] = input_fingerprints
+
+            self._changed = True
+
+    def save(self):
+        """Write the cache if anything has been added."""
+        with self._lock:
+            if self._path and self._changed:
+                try:
+                    os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+                    if plist.writePlist(path=self._path, data=self._entries) == plist.FAILED:
+                        LOG.error('Unable to write cache %s' % self._path)
+                    else:
+                        self._changed = False
+                except OSError as e:
+                    LOG.error('Unable to write cache %s - %s' % (self._path, e))
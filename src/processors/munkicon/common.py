@@ -1,44 +1,124 @@
-import subprocess
+import re
+import threading
 
-from distutils.version import LooseVersion
+from collections import namedtuple
+from functools import lru_cache, total_ordering
 
+try:
+    import backend
+    import executor
+    import plist
+except ImportError:
+    from . import backend
+    from . import executor
+    from . import plist
 
+# Persistent state that munkicon keeps between runs.
+CACHE_DIR = '/Library/Managed Installs/munkicon'
+
+SYSTEM_VERSION = '/System/Library/CoreServices/SystemVersion.plist'
+
+HostFacts = namedtuple('HostFacts', ['os_version', 'os_build', 'arch'])
+
+_HOST_FACTS = None
+_HOST_FACTS_LOCK = threading.Lock()
+
+
+@total_ordering
+class Version(object):
+    """Comparable version number, split into numeric and alphabetic components."""
+    __slots__ = ('vstring', '_key')
+    _component = re.compile(r'(\d+|[a-z]+)', re.IGNORECASE)
+
+    def __init__(self, vstring):
+        self.vstring = vstring
+
+        # Alphabetic components sort before numeric ones, so '1.0b1' < '1.0.1', and
+        # trailing zeros are ignored, so '11' == '11.0'.
+        _key = [(1, int(_c)) if _c.isdigit() else (0, _c.lower()) for _c in self._component.findall(vstring)]
+
+        while _key and _key[-1] == (1, 0):
+            _key.pop()
+
+        self._key = tuple(_key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+
+        return self._key == other._key
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+
+        return self._key < other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __str__(self):
+        return self.vstring
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.vstring)
+
+
+@lru_cache(maxsize=None)
 def vers_convert(ver=None):
-    """Convert a string into a LooseVersion object."""
-    # NOTE: Return '0.0.0' if 'ver' is None because LooseVersion can't handle 'None'
-    result = LooseVersion('0.0.0')
+    """Convert a string into a Version object."""
+    # NOTE: Return '0.0.0' if 'ver' is None so comparisons still work.
+    result = Version('0.0.0')
 
-    if not isinstance(ver, LooseVersion):
+    if not isinstance(ver, Version):
         if isinstance(ver, str):
-            result = LooseVersion(ver)
+            result = Version(ver)
         elif isinstance(ver, (float, int)):
-            result = LooseVersion(str(ver))
-    elif isinstance(ver, LooseVersion):
+            result = Version(str(ver))
+    elif isinstance(ver, Version):
         result = ver
 
     return result
 
 
-def os_build():
-    """macOS build"""
+def _sw_vers(arg):
+    """Value from 'sw_vers'."""
     result = None
-    cmd = ['/usr/bin/sw_vers', '-buildVersion']
-    _p = subprocess.run(cmd, capture_output=True, encoding='utf-8')
+    _p = executor.run(['/usr/bin/sw_vers', arg])
 
     if _p.returncode == 0:
-        result = _p.stdout.strip()
+        result = _p.out
 
     return result
 
 
-def os_version():
-    """macOS version number."""
-    # Note: Software version "might" get reported as '10.16' depending on Python used.
-    result = None
-    cmd = ['/usr/bin/sw_vers', '-productVersion']
-    _p = subprocess.run(cmd, capture_output=True, encoding='utf-8')
+def host_facts(path=SYSTEM_VERSION):
+    """OS version, build, and architecture ('arm64' or 'x86_64') of this Mac, read once per run."""
+    global _HOST_FACTS
 
-    if _p.returncode == 0:
-        result = vers_convert(_p.stdout.strip())
+    with _HOST_FACTS_LOCK:
+        if _HOST_FACTS is None:
+            _sys_ver = plist.readPlist(path=backend.path(path)) or dict()
+            _version = _sys_ver.get('ProductVersion')
+            _build = _sys_ver.get('ProductBuildVersion')
 
-    return result
+            # Python built against an older SDK may be shown the compatibility version.
+            if not _version or _version == '10.16':
+                _version = _sw_vers('-productVersion') or _version
+                _build = _sw_vers('-buildVersion') or _build
+
+            _HOST_FACTS = HostFacts(os_version=vers_convert(_version),
+                                    os_build=_build,
+                                    arch=backend.uname().machine)
+
+    return _HOST_FACTS
+
+
+def os_build():
+    """macOS build"""
+    return host_facts().os_build
+
+
+def os_version():
+    """macOS version number."""
+    return host_facts().os_version
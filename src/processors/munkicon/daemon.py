@@ -0,0 +1,250 @@
+"""Long running munkicon daemon serving conditions over a Unix socket."""
+import heapq
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import common
+    import plist
+except ImportError:
+    from . import common
+    from . import plist
+
+LOG = logging.getLogger(__name__)
+
+SOCKET_PATH = os.path.join(common.CACHE_DIR, 'munkicon.sock')
+
+# Seconds between refreshes of processors that don't declare a 'MAX_AGE'.
+DEFAULT_INTERVAL = 300
+
+# Seconds a client waits on the daemon before collecting conditions itself.
+CLIENT_TIMEOUT = 2
+
+MAX_MESSAGE = 64 * 1024 * 1024
+
+_HEADER = struct.Struct('>I')
+
+
+class DaemonError(Exception):
+    """The daemon can't be started, or a message is invalid."""
+
+
+def _recv_exactly(sock, size):
+    result = bytearray()
+
+    while len(result) < size:
+        _chunk = sock.recv(min(size - len(result), 65536))
+
+        if not _chunk:
+            raise DaemonError('Connection closed after {} of {} bytes'.format(len(result), size))
+
+        result.extend(_chunk)
+
+    return bytes(result)
+
+
+def send_message(sock, obj):
+    """Send a property list prefixed with its length."""
+    _data = plist.writePlistToString(obj, binary=True)
+    sock.sendall(_HEADER.pack(len(_data)) + _data)
+
+
+def recv_message(sock):
+    """Receive a length prefixed property list."""
+    _size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0]
+
+    if _size > MAX_MESSAGE:
+        raise DaemonError('Message of {} bytes is too large'.format(_size))
+
+    result = plist.readPlistFromString(_recv_exactly(sock, _size))
+
+    if not isinstance(result, dict):
+        raise DaemonError('Message is not a dictionary')
+
+    return result
+
+
+def fetch(processors=None, socket_path=SOCKET_PATH, timeout=CLIENT_TIMEOUT):
+    """Latest 'conditions' and their 'timestamps' from a running daemon, or None if it can't be reached."""
+    result = None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as _s:
+            _s.settimeout(timeout)
+            _s.connect(socket_path)
+            send_message(_s, {'processors': list(processors or list())})
+            result = recv_message(_s)
+
+        for _name, _timestamp in result.get('timestamps', dict()).items():
+            LOG.debug('%s: Conditions from daemon are %ss old.' % (_name, int(time.time() - _timestamp)))
+    except (OSError, DaemonError, ValueError) as e:
+        LOG.info('munkicon daemon unavailable at %s - %s' % (socket_path, e))
+
+    return result
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            self.request.settimeout(CLIENT_TIMEOUT)
+            _request = recv_message(self.request)
+            send_message(self.request, self.server.munkicon.snapshot(_request.get('processors')))
+        except (OSError, DaemonError, ValueError) as e:
+            LOG.debug('Bad request - %s' % e)
+
+
+class Daemon(object):
+    """Refreshes processors in the background and serves their latest conditions."""
+    def __init__(self, processors, intervals=None, interval=DEFAULT_INTERVAL, socket_path=SOCKET_PATH, workers=1,
+                 watcher=None):
+        self._processors = dict(processors)
+        self._intervals = {_name: (intervals or dict()).get(_name) or interval for _name in self._processors}
+        self._socket_path = socket_path
+        self._snapshot = dict()
+        self._lock = threading.Lock()
+        self._queue = [(time.monotonic(), _name) for _name in self._processors]
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='munkicon-daemon')
+        self._server = None
+        self._threads = list()
+        self._watcher = watcher
+
+        heapq.heapify(self._queue)
+
+    def refresh(self, name):
+        """Run a processor and keep its conditions. A failed run keeps the previous conditions."""
+        result = self._processors[name]()
+
+        if result is not None:
+            with self._lock:
+                self._snapshot[name] = (result, time.time())
+
+        return result
+
+    def snapshot(self, processors=None):
+        """Latest conditions and their timestamps, for all processors or only those named."""
+        result = {'conditions': dict(), 'timestamps': dict()}
+
+        with self._lock:
+            for _name, (_conditions, _timestamp) in self._snapshot.items():
+                if not processors or _name in processors:
+                    result['conditions'][_name] = _conditions
+                    result['timestamps'][_name] = _timestamp
+
+        return result
+
+    def _refresh(self, name, reschedule=True):
+        """Refresh a processor, and schedule its next refresh once finished."""
+        # Refreshes still queued when stopping don't run.
+        if self._stop.is_set():
+            return
+
+        try:
+            self.refresh(name)
+        except Exception as e:
+            LOG.error('%s: %s' % (name, e))
+        finally:
+            if reschedule:
+                with self._wake:
+                    heapq.heappush(self._queue, (time.monotonic() + self._intervals[name], name))
+                    self._wake.notify()
+
+    def _schedule(self):
+        """Start refreshes of processors as they become due, until stopped."""
+        with self._wake:
+            while not self._stop.is_set():
+                _now = time.monotonic()
+
+                if self._queue and self._queue[0][0] <= _now:
+                    _, _name = heapq.heappop(self._queue)
+                    self._pool.submit(self._refresh, _name)
+                else:
+                    self._wake.wait(timeout=self._queue[0][0] - _now if self._queue else None)
+
+    def _watch(self):
+        """Refresh processors as soon as their inputs change."""
+        for _changed in self._watcher.changes():
+            for _name in sorted(_changed):
+                self._pool.submit(self._refresh, _name, False)
+
+    def _bind(self):
+        """Bind the socket, replacing a stale socket left by a daemon that has exited."""
+        os.makedirs(os.path.dirname(self._socket_path), exist_ok=True)
+
+        if os.path.exists(self._socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as _s:
+                try:
+                    _s.connect(self._socket_path)
+                    raise DaemonError('munkicon daemon already running at {}'.format(self._socket_path))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.remove(self._socket_path)
+
+        result = socketserver.ThreadingUnixStreamServer(self._socket_path, _Handler)
+        result.daemon_threads = True
+        result.munkicon = self
+
+        # Conditions are only served to root.
+        os.chmod(self._socket_path, 0o600)
+
+        return result
+
+    def start(self):
+        """Start serving and refreshing processors in background threads."""
+        self._server = self._bind()
+        self._threads = [threading.Thread(target=self._server.serve_forever, name='munkicon-server', daemon=True),
+                         threading.Thread(target=self._schedule, name='munkicon-scheduler', daemon=True)]
+
+        if self._watcher:
+            self._threads.append(threading.Thread(target=self._watch, name='munkicon-watcher', daemon=True))
+
+        for _thread in self._threads:
+            _thread.start()
+
+        LOG.info('Serving conditions for %s at %s' % (', '.join(sorted(self._processors)), self._socket_path))
+
+    def stop(self):
+        """Stop serving and refreshing processors, and remove the socket."""
+        self._stop.set()
+
+        with self._wake:
+            self._wake.notify()
+
+        if self._watcher:
+            self._watcher.stop()
+
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+            try:
+                os.remove(self._socket_path)
+            except OSError:
+                pass
+
+        self._pool.shutdown(wait=False)
+        LOG.info('Stopped serving conditions.')
+
+    def serve(self):
+        """Serve until stopped by SIGTERM or SIGINT."""
+        self.start()
+
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def shutdown(self, *args):
+        """Ask serve() to return, for use as a signal handler."""
+        self._stop.set()
@@ -0,0 +1,373 @@
+"""Shared command executor for processors."""
+import logging
+import os
+import select
+import selectors
+import signal
+import subprocess
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import backend
+    import timing
+except ImportError:
+    from . import backend
+    from . import timing
+
+LOG = logging.getLogger(__name__)
+
+# Maximum number of child processes running at once.
+DEFAULT_LIMIT = 8
+
+# Seconds a command may run for before it is terminated.
+DEFAULT_TIMEOUT = 60
+
+# Seconds between asking a command to terminate and killing it.
+GRACE = 1
+
+_LIMIT = DEFAULT_LIMIT
+_TIMEOUT = DEFAULT_TIMEOUT
+_POOL = None
+_IN_FLIGHT = dict()
+_CHILDREN = set()
+_LOCK = threading.Lock()
+
+
+class CommandResult(namedtuple('CommandResult', ['cmd', 'returncode', 'stdout', 'stderr', 'timed_out'],
+                               defaults=[False])):
+    """Result of a command. 'stdout' and 'stderr' are bytes."""
+    __slots__ = ()
+
+    @property
+    def out(self):
+        """stdout decoded and stripped."""
+        return (self.stdout or b'').decode('utf-8', errors='replace').strip()
+
+    @property
+    def err(self):
+        """stderr decoded and stripped."""
+        return (self.stderr or b'').decode('utf-8', errors='replace').strip()
+
+    @property
+    def failed(self):
+        """True if the command timed out or exited non-zero."""
+        return self.timed_out or self.returncode != 0
+
+
+class CommandError(Exception):
+    """A command failed or timed out, so its output can't be used."""
+    def __init__(self, result):
+        self.result = result
+
+        if result.timed_out:
+            _reason = 'timed out'
+        else:
+            _reason = 'exited with {}'.format(result.returncode)
+
+        super().__init__('{} {}'.format(' '.join(result.cmd), _reason))
+
+
+def set_limit(limit):
+    """Set the maximum number of commands running at once. Takes effect before the first command is run."""
+    global _LIMIT
+
+    with _LOCK:
+        if _POOL is None:
+            _LIMIT = max(1, int(limit))
+        elif limit != _LIMIT:
+            LOG.debug('Executor already started with a limit of %s' % _LIMIT)
+
+
+def set_timeout(timeout):
+    """Set the command timeout in seconds. None or 0 disables the timeout."""
+    global _TIMEOUT
+
+    _TIMEOUT = timeout or None
+
+
+def _pool():
+    global _POOL
+
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=_LIMIT, thread_name_prefix='munkicon-cmd')
+
+    return _POOL
+
+
+def popen(cmd, **kwargs):
+    """Start a command to use with watchdog(), or run it to completion when recording or replaying."""
+    if backend.mode():
+        return backend.Process(_execute(list(cmd), processor=timing.current()), **kwargs)
+
+    return _popen(cmd, processor=timing.current(), **kwargs)
+
+
+class _Popen(subprocess.Popen):
+    """Popen for a command run for 'processor', reaped by _reap() rather than wait()."""
+    def __init__(self, cmd, processor=None, **kwargs):
+        self.processor = processor
+        self.rusage = None
+        self.exited = threading.Event()
+        self._started = time.monotonic()
+
+        super().__init__(cmd, **kwargs)
+
+
+def _popen(cmd, processor=None, **kwargs):
+    # With 'close_fds' False, subprocess uses posix_spawn() rather than fork()/exec().
+    # File descriptors opened by Python are non-inheritable, so nothing leaks into the child.
+    kwargs.setdefault('stdin', subprocess.DEVNULL)
+    kwargs.setdefault('close_fds', False)
+
+    return _Popen(cmd, processor=processor, **kwargs)
+
+
+def _reap(proc):
+    """Wait for a process to exit with wait4(), adding its run time and resource usage to the timings."""
+    if proc.exited.is_set():
+        return
+
+    try:
+        _pid, _status, proc.rusage = os.wait4(proc.pid, 0)
+        proc.returncode = -os.WTERMSIG(_status) if os.WIFSIGNALED(_status) else os.WEXITSTATUS(_status)
+    except ChildProcessError:
+        # Reaped elsewhere, so only subprocess knows how it exited.
+        proc.wait()
+
+    timing.add_command(proc.args, time.monotonic() - proc._started, processor=proc.processor, rusage=proc.rusage)
+    proc.exited.set()
+
+
+def _signal(proc, sig):
+    # Popen.send_signal() polls the process first, which can reap it before _reap() does.
+    if proc.returncode is None:
+        os.kill(proc.pid, sig)
+
+
+def _stop(proc):
+    """Terminate a process, killing it if it hasn't exited within the grace period."""
+    try:
+        _signal(proc, signal.SIGTERM)
+
+        if not proc.exited.wait(GRACE):
+            _signal(proc, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def kill_all():
+    """Stop all running commands, for example when the run deadline has passed."""
+    with _LOCK:
+        _children = list(_CHILDREN)
+
+    for _p in _children:
+        LOG.warning('Stopping %s' % _p.args)
+        _stop(_p)
+
+
+@contextmanager
+def watchdog(proc, timeout=None):
+    """Stop a process started with popen() if it is still running after the command timeout, and reap it."""
+    # Processes served by the backend have already finished.
+    if not isinstance(proc, _Popen):
+        yield proc
+        return
+
+    _timeout = timeout or _TIMEOUT
+    _timer = threading.Timer(_timeout, _stop, args=(proc,)) if _timeout else None
+
+    with _LOCK:
+        _CHILDREN.add(proc)
+
+    try:
+        if _timer:
+            _timer.daemon = True
+            _timer.start()
+
+        yield proc
+    except BaseException:
+        # Close its output so a command that is still writing exits, as Popen.__exit__() does.
+        for _stream in (proc.stdout, proc.stderr):
+            if _stream:
+                _stream.close()
+
+        raise
+    finally:
+        _reap(proc)
+
+        if _timer:
+            _timer.cancel()
+
+        with _LOCK:
+            _CHILDREN.discard(proc)
+
+
+def _communicate(proc, input=None, timeout=None):
+    """Write 'input' to a process and read its output like Popen.communicate(), without reaping it."""
+    _output = {proc.stdout: list(), proc.stderr: list()}
+    _input = memoryview(input or b'')
+    _deadline = time.monotonic() + timeout if timeout else None
+
+    with selectors.DefaultSelector() as _selector:
+        for _stream in _output:
+            _selector.register(_stream, selectors.EVENT_READ)
+
+        if _input and proc.stdin and not proc.stdin.closed:
+            _selector.register(proc.stdin, selectors.EVENT_WRITE)
+        elif proc.stdin:
+            proc.stdin.close()
+
+        while _selector.get_map():
+            _remaining = _deadline - time.monotonic() if _deadline else None
+
+            if _remaining is not None and _remaining <= 0:
+                break
+
+            for _key, _events in _selector.select(_remaining):
+                if _key.fileobj is proc.stdin:
+                    try:
+                        _input = _input[os.write(_key.fd, _input[:select.PIPE_BUF]):]
+                    except BrokenPipeError:
+                        _input = b''
+
+                    if not _input:
+                        _selector.unregister(proc.stdin)
+                        proc.stdin.close()
+                else:
+                    _data = os.read(_key.fd, 32768)
+
+                    if _data:
+                        _output[_key.fileobj].append(_data)
+                    else:
+                        _selector.unregister(_key.fileobj)
+
+        _finished = not _selector.get_map()
+
+    result = (b''.join(_output[proc.stdout]), b''.join(_output[proc.stderr]), _finished)
+
+    return result
+
+
+def _execute(cmd, input=None, processor=None):
+    """Run a command for 'processor' to completion, or until it times out."""
+    _start = time.monotonic()
+
+    if backend.replaying():
+        result = _replay(cmd, input)
+        timing.add_command(cmd, time.monotonic() - _start, processor=processor)
+
+        return result
+
+    _timed_out = False
+
+    try:
+        with _popen(cmd, processor=processor, stdin=subprocess.PIPE if input else subprocess.DEVNULL,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE) as _p:
+            with _LOCK:
+                _CHILDREN.add(_p)
+
+            try:
+                _r, _e, _finished = _communicate(_p, input, timeout=_TIMEOUT)
+
+                if not _finished:
+                    LOG.warning('Stopping %s after %ss' % (cmd, _TIMEOUT))
+                    _timed_out = True
+                    _signal(_p, signal.SIGTERM)
+
+                    # Children of the command may still hold its output open.
+                    _more_r, _more_e, _finished = _communicate(_p, timeout=GRACE)
+                    _r, _e = _r + _more_r, _e + _more_e
+
+                    if not _finished:
+                        _signal(_p, signal.SIGKILL)
+
+                _reap(_p)
+            finally:
+                with _LOCK:
+                    _CHILDREN.discard(_p)
+
+        result = CommandResult(cmd=cmd, returncode=_p.returncode, stdout=_r, stderr=_e, timed_out=_timed_out)
+    except OSError as e:
+        # Missing binaries and the like are reported the same way as a failed command.
+        LOG.debug('Unable to run %s - %s' % (cmd, e))
+        result = CommandResult(cmd=cmd, returncode=127, stdout=b'', stderr=str(e).encode())
+
+    backend.add_command(result, input=input, duration=time.monotonic() - _start)
+
+    return result
+
+
+def _replay(cmd, input=None):
+    """Recorded result of a command. Commands that weren't recorded fail as if missing."""
+    _entry = backend.command(cmd, input=input)
+
+    if _entry:
+        result = CommandResult(cmd=cmd, returncode=_entry['returncode'], stdout=_entry['stdout'],
+                               stderr=_entry['stderr'], timed_out=_entry.get('timed_out', False))
+    else:
+        result = CommandResult(cmd=cmd, returncode=127, stdout=b'', stderr=b'Command not recorded')
+
+    return result
+
+
+def submit(cmd, input=None):
+    """Submit a command, returning a Future of its CommandResult."""
+    _cmd = list(cmd)
+
+    # Commands with input are never shared.
+    if input is not None:
+        return _pool().submit(_execute, _cmd, input, timing.current())
+
+    _key = tuple(_cmd)
+
+    with _LOCK:
+        result = _IN_FLIGHT.get(_key)
+
+    if result is None:
+        _future = _pool().submit(_execute, _cmd, None, timing.current())
+
+        with _LOCK:
+            # Another thread may have submitted the same command meanwhile.
+            result = _IN_FLIGHT.setdefault(_key, _future)
+
+        # Outside the lock, as the callback runs straight away if the command has already finished.
+        if result is _future:
+            result.add_done_callback(lambda _f: _forget(_key, _f))
+
+    return result
+
+
+def _forget(key, future):
+    with _LOCK:
+        if _IN_FLIGHT.get(key) is future:
+            del _IN_FLIGHT[key]
+
+
+def run(cmd, input=None):
+    """Run a command and wait for its CommandResult."""
+    return submit(cmd, input=input).result()
+
+
+def run_all(cmds):
+    """Run commands concurrently, returning their CommandResults in the same order."""
+    _futures = [submit(_cmd) for _cmd in cmds]
+
+    return [_f.result() for _f in _futures]
+
+
+class Batch(object):
+    """Commands started together up front, with results collected as each is needed."""
+    def __init__(self, cmds):
+        self._futures = {tuple(_cmd): submit(_cmd) for _cmd in cmds}
+
+    def run(self, cmd):
+        """Result of a command in the batch, or run it now if it isn't in the batch."""
+        _future = self._futures.pop(tuple(cmd), None)
+
+        return _future.result() if _future else run(cmd)
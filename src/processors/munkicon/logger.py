@@ -0,0 +1,139 @@
+"""Log file handling."""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+from datetime import datetime
+
+TEXT = 'text'
+JSON = 'json'
+
+# Rotate the log when it reaches this size, keeping this many previous logs.
+MAX_BYTES = 1048576 * 10
+BACKUPS = 7
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has, so anything else was passed with 'extra'.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', logging.INFO, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_LISTENER = None
+_QUEUE_HANDLER = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object."""
+    def format(self, record):
+        _event = {'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+                  'elapsed': round(record.relativeCreated / 1000, 6),
+                  'level': record.levelname,
+                  'logger': record.name,
+                  'thread': record.threadName,
+                  'message': record.getMessage()}
+
+        _event.update({_k: _v for _k, _v in vars(record).items() if _k not in _RECORD_ATTRS})
+
+        if record.exc_info:
+            _event['exception'] = self.formatException(record.exc_info)
+
+        result = json.dumps(_event, default=str)
+
+        return result
+
+
+def _started(path):
+    """Time of the first record in a log, or when it was last written if that can't be read."""
+    result = None
+
+    try:
+        with open(path) as _f:
+            _line = _f.readline()
+
+        try:
+            result = datetime.fromisoformat(json.loads(_line)['time']).timestamp()
+        except (ValueError, KeyError, TypeError):
+            result = time.mktime(time.strptime(_line[:19], DATE_FORMAT))
+    except ValueError:
+        result = os.stat(path).st_mtime
+    except OSError:
+        pass
+
+    return result
+
+
+class DaysRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rotates a log at midnight once it is 'days' old, counted from its first record."""
+    def __init__(self, filename, days=1, backupCount=0):
+        super().__init__(filename, when='midnight', interval=days, backupCount=backupCount)
+
+        # TimedRotatingFileHandler counts from when the log was last written, so a
+        # log written by every run would never be rotated.
+        self.rolloverAt = self.computeRollover(_started(self.baseFilename) or time.time())
+
+    def computeRollover(self, currentTime):
+        # The midnight following 'currentTime', then the remaining days.
+        return super().computeRollover(currentTime) + self.interval - 86400
+
+
+def _file_handler(path, max_bytes=MAX_BYTES, backups=BACKUPS, rotate_days=None):
+    if rotate_days:
+        result = DaysRotatingFileHandler(path, days=rotate_days, backupCount=backups)
+    else:
+        result = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+
+    return result
+
+
+def setup(path, format=TEXT, max_bytes=MAX_BYTES, backups=BACKUPS, rotate_days=None, level=logging.DEBUG):
+    """Log everything at 'level' and above to 'path', or stderr if it can't be opened, from a background thread."""
+    global _LISTENER, _QUEUE_HANDLER
+
+    try:
+        _handler = _file_handler(path, max_bytes=max_bytes, backups=backups, rotate_days=rotate_days)
+        _error = None
+    except OSError as e:
+        _handler = logging.StreamHandler(sys.stderr)
+        _error = e
+
+    if format == JSON:
+        _handler.setFormatter(JSONFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT))
+
+    _queue = queue.SimpleQueue()
+    _log = logging.getLogger()
+    _log.setLevel(level)
+    _QUEUE_HANDLER = logging.handlers.QueueHandler(_queue)
+    _log.addHandler(_QUEUE_HANDLER)
+
+    _LISTENER = logging.handlers.QueueListener(_queue, _handler)
+    _LISTENER.start()
+
+    # Registered after logging's own exit handler, so records are flushed before the file is closed.
+    atexit.register(stop)
+
+    if _error:
+        logging.getLogger(__name__).warning('Unable to log to %s, logging to stderr - %s' % (path, _error))
+
+
+def stop():
+    """Write any queued records and log directly from then on."""
+    global _LISTENER, _QUEUE_HANDLER
+
+    if _LISTENER:
+        _log = logging.getLogger()
+
+        for _handler in _LISTENER.handlers:
+            _log.addHandler(_handler)
+
+        _log.removeHandler(_QUEUE_HANDLER)
+        _LISTENER.stop()
+
+        _LISTENER = None
+        _QUEUE_HANDLER = None
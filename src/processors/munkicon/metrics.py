@@ -0,0 +1,179 @@
+"""Run metrics for fleet monitoring."""
+import json
+import logging
+import os
+import resource
+import time
+
+from collections.abc import Sized
+
+try:
+    import common
+    import plist
+    import timing
+except ImportError:
+    from . import common
+    from . import plist
+    from . import timing
+
+LOG = logging.getLogger(__name__)
+
+METRICS_FILE = os.path.join(common.CACHE_DIR, 'metrics.prom')
+
+PREFIX = 'munkicon'
+
+# Processor statuses.
+COLLECTED = 'collected'
+CACHED = 'cached'
+DAEMON = 'daemon'
+STALE = 'stale'
+FAILED = 'failed'
+UNFINISHED = 'unfinished'
+
+
+def children_usage():
+    """CPU seconds used by, and the largest peak memory in bytes of, all child processes reaped so far."""
+    _usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    result = {'cpu_seconds': _usage.ru_utime + _usage.ru_stime,
+              'max_rss_bytes': _usage.ru_maxrss * timing.MAXRSS_UNIT}
+
+    return result
+
+
+def _count(value):
+    """Number of values in a condition."""
+    result = 1
+
+    if value is None or value == '':
+        result = 0
+    elif isinstance(value, Sized) and not isinstance(value, (str, bytes)):
+        result = len(value)
+
+    return result
+
+
+def _command_name(cmd):
+    """Binary and first argument of a command, without arguments such as user names."""
+    return ' '.join([os.path.basename(cmd[0])] + list(cmd[1:2])) if cmd else ''
+
+
+def collect(duration, statuses, timings, conditions, write_status, children_before=None):
+    """Metrics of a run, from processor statuses, timing.summary() and the conditions written."""
+    _children = children_usage()
+    _before = children_before or {'cpu_seconds': 0}
+    _commands = timings.get('commands', list())
+
+    result = {'timestamp': int(time.time()),
+              'duration_seconds': duration,
+              'conditions_write_skipped': write_status == plist.UNCHANGED,
+              'conditions_write_failed': write_status == plist.FAILED,
+              'children': {'count': len([_c for _c in _commands if _c['cpu_seconds'] is not None]),
+                           'cpu_seconds': _children['cpu_seconds'] - _before['cpu_seconds'],
+                           'max_rss_bytes': _children['max_rss_bytes']},
+              'processors': dict(),
+              'commands': list(),
+              'condition_values': dict()}
+
+    for _name, _status in statuses.items():
+        result['processors'][_name] = {'status': _status,
+                                       'duration_seconds': timings.get('processors', dict()).get(_name),
+                                       'commands': len([_c for _c in _commands if _c['processor'] == _name])}
+
+    for _c in _commands:
+        result['commands'].append({'processor': _c['processor'] or PREFIX,
+                                   'command': _command_name(_c['cmd']),
+                                   'duration_seconds': _c['seconds'],
+                                   'cpu_seconds': _c['cpu_seconds'],
+                                   'max_rss_bytes': _c['max_rss_bytes']})
+
+    for _conditions in conditions.values():
+        for _key, _value in (_conditions or dict()).items():
+            result['condition_values'][_key] = _count(_value)
+
+    return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, value, labels=None):
+    _labels = ','.join('{}="{}"'.format(_k, _escape(_v)) for _k, _v in (labels or dict()).items())
+
+    return '{}_{}{} {}'.format(PREFIX, name, '{{{}}}'.format(_labels) if _labels else '', float(value))
+
+
+def to_textfile(metrics):
+    """Metrics in the node exporter textfile collector format."""
+    _families = list()
+
+    def _family(name, help, samples):
+        _families.append('# HELP {}_{} {}'.format(PREFIX, name, help))
+        _families.append('# TYPE {}_{} gauge'.format(PREFIX, name))
+        _families.extend(_sample(name, _value, _labels) for _labels, _value in samples)
+
+    _family('run_timestamp_seconds', 'When the last run finished.', [(None, metrics['timestamp'])])
+    _family('run_duration_seconds', 'Time taken by the last run.', [(None, metrics['duration_seconds'])])
+    _family('conditions_write_skipped', 'Whether writing conditions was skipped as they were unchanged.',
+            [(None, int(metrics['conditions_write_skipped']))])
+    _family('conditions_write_failed', 'Whether writing conditions failed.',
+            [(None, int(metrics['conditions_write_failed']))])
+
+    _processors = sorted(metrics['processors'].items())
+    _family('processor_status', 'Status of each processor in the last run.',
+            [({'processor': _name, 'status': _p['status']}, 1) for _name, _p in _processors])
+    _family('processor_duration_seconds', 'Time taken by each processor that ran.',
+            [({'processor': _name}, _p['duration_seconds']) for _name, _p in _processors
+             if _p['duration_seconds'] is not None])
+    _family('processor_commands', 'Commands run by each processor.',
+            [({'processor': _name}, _p['commands']) for _name, _p in _processors])
+
+    _children = metrics['children']
+    _family('children', 'Child processes reaped in the last run.', [(None, _children['count'])])
+    _family('children_cpu_seconds', 'CPU time of all child processes in the last run.',
+            [(None, _children['cpu_seconds'])])
+    _family('children_max_rss_bytes', 'Largest peak memory of any child process.', [(None, _children['max_rss_bytes'])])
+
+    # The same command can be run more than once by a processor, for example once per user.
+    _commands = dict()
+
+    for _c in metrics['commands']:
+        _key = (_c['processor'], _c['command'])
+        _agg = _commands.setdefault(_key, {'runs': 0, 'duration_seconds': 0, 'cpu_seconds': 0, 'max_rss_bytes': 0})
+        _agg['runs'] += 1
+        _agg['duration_seconds'] += _c['duration_seconds']
+        _agg['cpu_seconds'] += _c['cpu_seconds'] or 0
+        _agg['max_rss_bytes'] = max(_agg['max_rss_bytes'], _c['max_rss_bytes'] or 0)
+
+    _commands = sorted(_commands.items())
+    _family('command_runs', 'Times each command was run.',
+            [({'processor': _p, 'command': _cmd}, _agg['runs']) for (_p, _cmd), _agg in _commands])
+    _family('command_duration_seconds', 'Total time taken by each command.',
+            [({'processor': _p, 'command': _cmd}, _agg['duration_seconds']) for (_p, _cmd), _agg in _commands])
+    _family('command_cpu_seconds', 'Total CPU time of each command.',
+            [({'processor': _p, 'command': _cmd}, _agg['cpu_seconds']) for (_p, _cmd), _agg in _commands])
+    _family('command_max_rss_bytes', 'Largest peak memory of each command.',
+            [({'processor': _p, 'command': _cmd}, _agg['max_rss_bytes']) for (_p, _cmd), _agg in _commands])
+
+    _family('condition_values', 'Number of values written for each condition key.',
+            [({'key': _key}, _count) for _key, _count in sorted(metrics['condition_values'].items())])
+
+    result = '\n'.join(_families) + '\n'
+
+    return result
+
+
+def write(metrics, path=METRICS_FILE):
+    """Write metrics atomically, so a collector never reads a partly written file."""
+    if path.endswith('.json'):
+        _data = json.dumps(metrics, indent=2, sort_keys=True) + '\n'
+    else:
+        _data = to_textfile(metrics)
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        plist.atomic_write(path, _data.encode())
+        LOG.debug('Metrics written to %s' % path)
+    except OSError as e:
+        LOG.error('Unable to write metrics %s - %s' % (path, e))
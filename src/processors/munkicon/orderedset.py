@@ -0,0 +1,39 @@
+"""Insertion ordered set for list valued conditions."""
+from collections.abc import MutableSet
+
+
+class OrderedSet(MutableSet):
+    """A set that keeps values in the order they were first added."""
+    def __init__(self, iterable=None):
+        self._items = dict()
+
+        if iterable:
+            self.update(iterable)
+
+    def __contains__(self, value):
+        return value in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, list(self._items))
+
+    def __eq__(self, other):
+        if isinstance(other, OrderedSet):
+            return list(self) == list(other)
+
+        return super().__eq__(other)
+
+    def add(self, value):
+        self._items[value] = None
+
+    def discard(self, value):
+        self._items.pop(value, None)
+
+    def update(self, iterable):
+        for _value in iterable:
+            self._items[_value] = None
@@ -1,22 +1,104 @@
 """Wrappers for plistlib"""
+import hashlib
 import logging
 import os
 import plistlib
 import shutil
 import subprocess
 import tempfile
+import threading
 
+from collections import OrderedDict
 from sys import version_info
 from xml.parsers.expat import ExpatError
 
+try:
+    from orderedset import OrderedSet
+except ImportError:
+    from .orderedset import OrderedSet
+
 LOG = logging.getLogger(__name__)
 
 # plistlib.readPlist() and plistlib.writePlist() deprecated in Python 3.4+
 DEPRECATED = (version_info.major == 3 and version_info.minor > 4)
 
+# Parsed property lists, keyed by path. Each entry holds the file fingerprint it
+# was parsed from, so a changed file is re-parsed. Least recently used entries
+# are evicted once there are more than CACHE_SIZE.
+CACHE_SIZE = 32
+
+# What writePlist() did.
+WRITTEN = 'written'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def fingerprint(path):
+    """(st_mtime_ns, st_size, st_ino) of a file, or None if it doesn't exist."""
+    result = None
+
+    try:
+        _st = os.stat(path)
+        result = (_st.st_mtime_ns, _st.st_size, _st.st_ino)
+    except OSError:
+        pass
+
+    return result
+
+
+def _copy(obj):
+    """Shallow copy so callers can update the top level of a cached result."""
+    result = obj
+
+    if isinstance(obj, dict):
+        result = dict(obj)
+    elif isinstance(obj, list):
+        result = list(obj)
+
+    return result
+
+
+def clearCache():
+    """Discard all cached property lists."""
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
 
 def readPlist(path):
-    """Read a property list."""
+    """Read a property list, cached for as long as the file is unchanged."""
+    # Nested values of cached results are shared between callers and must not be modified.
+    result = dict()
+    _fingerprint = fingerprint(path)
+
+    if _fingerprint:
+        _key = os.path.abspath(path)
+
+        with _CACHE_LOCK:
+            _cached = _CACHE.get(_key)
+
+            if _cached and _cached[0] == _fingerprint:
+                _CACHE.move_to_end(_key)
+                return _copy(_cached[1])
+
+        result = _readPlist(path)
+
+        if result is not None:
+            with _CACHE_LOCK:
+                _CACHE[_key] = (_fingerprint, result)
+                _CACHE.move_to_end(_key)
+
+                while len(_CACHE) > CACHE_SIZE:
+                    _CACHE.popitem(last=False)
+
+            result = _copy(result)
+
+    return result
+
+
+def _readPlist(path):
+    """Read and parse a property list."""
     result = dict()
 
     if os.path.exists(path):
@@ -64,23 +146,101 @@ def readPlistFromString(obj):
     return result
 
 
-def writePlist(path, data):
-    """Write a property list to file."""
-    if os.path.exists(path):
-        _data = readPlist(path)
+def _canonical(obj):
+    """Convert unordered collections to sorted lists so output is stable between runs."""
+    result = obj
 
-        _data.update(data)
-    else:
-        _data = data
+    if isinstance(obj, dict):
+        result = {_k: _canonical(_v) for _k, _v in obj.items()}
+    elif isinstance(obj, OrderedSet):
+        # Written in insertion order.
+        result = [_canonical(_v) for _v in obj]
+    elif isinstance(obj, (set, frozenset)):
+        result = sorted(_canonical(_v) for _v in obj)
+    elif isinstance(obj, (list, tuple)):
+        result = [_canonical(_v) for _v in obj]
 
-    if DEPRECATED:
-        with open(path, 'wb') as _f:
-            try:
-                plistlib.dump(_data, _f)
-            except Exception as e:
-                LOG.error('Exception writing %s - %s' % (path, e))
-    else:
+    return result
+
+
+def _digest(path):
+    """SHA-256 digest of a file, or None if it can't be read."""
+    result = None
+
+    try:
+        with open(path, 'rb') as _f:
+            result = hashlib.sha256(_f.read()).hexdigest()
+    except OSError:
+        pass
+
+    return result
+
+
+def atomic_write(path, data):
+    """Write bytes to a temporary file in the same directory, fsync and rename into place."""
+    _dir = os.path.dirname(os.path.abspath(path))
+    _fd, _tmp_path = tempfile.mkstemp(prefix='.{}.'.format(os.path.basename(path)), dir=_dir)
+
+    try:
+        with os.fdopen(_fd, 'wb') as _f:
+            _f.write(data)
+            _f.flush()
+            os.fsync(_f.fileno())
+
+        # mkstemp creates files as 0600, keep the existing mode if replacing a file.
         try:
-            plistlib.writePlist(_data, path)
-        except Exception as e:
-            LOG.error('Exception writing %s - %s' % (path, e))
+            _mode = os.stat(path).st_mode & 0o7777
+        except OSError:
+            _mode = 0o644
+
+        os.chmod(_tmp_path, _mode)
+        os.replace(_tmp_path, path)
+    except Exception:
+        if os.path.exists(_tmp_path):
+            os.remove(_tmp_path)
+
+        raise
+
+    # Persist the rename itself.
+    try:
+        _dir_fd = os.open(_dir, os.O_RDONLY)
+
+        try:
+            os.fsync(_dir_fd)
+        finally:
+            os.close(_dir_fd)
+    except OSError:
+        pass
+
+
+def writePlistToString(data, binary=False):
+    """Serialise a property list to bytes, in the same stable form as writePlist()."""
+    result = None
+
+    if binary:
+        result = plistlib.dumps(_canonical(data), fmt=plistlib.FMT_BINARY)
+    elif DEPRECATED:
+        result = plistlib.dumps(_canonical(data))
+    else:
+        result = plistlib.writePlistToString(_canonical(data))
+
+    return result
+
+
+def writePlist(path, data):
+    """Write a property list to file atomically, returning WRITTEN, UNCHANGED or FAILED."""
+    result = FAILED
+
+    try:
+        _data = writePlistToString(data)
+
+        if _digest(path) == hashlib.sha256(_data).hexdigest():
+            LOG.debug('%s unchanged, skipping write' % path)
+            result = UNCHANGED
+        else:
+            atomic_write(path, _data)
+            result = WRITTEN
+    except Exception as e:
+        LOG.error('Exception writing %s - %s' % (path, e))
+
+    return result
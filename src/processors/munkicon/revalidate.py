@@ -0,0 +1,65 @@
+"""Stale-while-revalidate support."""
+import fcntl
+import logging
+import os
+import subprocess
+import sys
+
+from datetime import datetime, timezone
+
+try:
+    import common
+    import plist
+except ImportError:
+    from . import common
+    from . import plist
+
+LOG = logging.getLogger(__name__)
+
+FRESHNESS_FILE = os.path.join(common.CACHE_DIR, 'freshness.plist')
+LOCK_FILE = os.path.join(common.CACHE_DIR, 'refresh.lock')
+
+# Passed to the background process so it takes the refresh lock.
+REVALIDATE_ARG = '--revalidate'
+
+
+def refresh_lock(path=LOCK_FILE):
+    """Take the refresh lock until the returned file is closed, or return None if another process holds it."""
+    result = None
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _f = open(path, 'a')
+
+    try:
+        fcntl.flock(_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        result = _f
+    except OSError:
+        _f.close()
+
+    return result
+
+
+def spawn(args):
+    """Start munkicon with 'args' in a new session, detached from this process."""
+    _cmd = [sys.executable, sys.argv[0]] + list(args) + [REVALIDATE_ARG]
+
+    subprocess.Popen(_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     close_fds=True, start_new_session=True)
+    LOG.info('Refreshing conditions in the background.')
+
+
+def write_freshness(conditions, timestamps, path=FRESHNESS_FILE):
+    """Record when each condition key was last collected, keeping entries of processors that weren't run."""
+    _freshness = plist.readPlist(path=path) or dict()
+
+    for _name, _conditions in conditions.items():
+        if _conditions and timestamps.get(_name):
+            # Property list dates are naive and in UTC.
+            _when = datetime.fromtimestamp(timestamps[_name], timezone.utc).replace(tzinfo=None, microsecond=0)
+            _freshness.update({_key: _when for _key in _conditions})
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        plist.writePlist(path=path, data=_freshness)
+    except OSError as e:
+        LOG.error('Unable to write freshness %s - %s' % (path, e))
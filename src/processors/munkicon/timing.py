@@ -0,0 +1,182 @@
+"""Timing of processors, their steps, and the commands they run."""
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+LOG = logging.getLogger(__name__)
+
+# Number of slowest commands listed in the summary.
+SLOWEST = 5
+
+# Number of functions listed in each processor's profile report.
+PROFILE_LINES = 30
+
+# 'ru_maxrss' is in bytes on macOS and kilobytes elsewhere.
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_ENABLED = False
+_LOCAL = threading.local()
+_PROCESSORS = dict()
+_STEPS = dict()
+_COMMANDS = list()
+_LOCK = threading.Lock()
+
+
+def enable(enabled=True):
+    """Start (or stop) keeping timings."""
+    global _ENABLED
+
+    _ENABLED = enabled
+
+
+def current():
+    """Name of the processor running in this thread, or None."""
+    return getattr(_LOCAL, 'processor', None)
+
+
+def timed(func):
+    """Time a processor step, such as a method called by '_process()'."""
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        if not _ENABLED:
+            return func(*args, **kwargs)
+
+        _start = time.perf_counter()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add_step(func.__name__, time.perf_counter() - _start)
+
+    return _wrapper
+
+
+def add_step(step, seconds, processor=None):
+    """Add the time taken by a step. Steps run more than once are added together."""
+    if not _ENABLED:
+        return
+
+    _key = (processor or current(), step)
+
+    with _LOCK:
+        _STEPS[_key] = _STEPS.get(_key, 0) + seconds
+
+
+def add_command(cmd, seconds, processor=None, rusage=None):
+    """Add the time taken by a command run for 'processor', and the resource usage of its process."""
+    if not _ENABLED:
+        return
+
+    _command = {'processor': processor,
+                'cmd': list(cmd),
+                'seconds': seconds,
+                'cpu_seconds': None,
+                'max_rss_bytes': None}
+
+    if rusage:
+        _command['cpu_seconds'] = rusage.ru_utime + rusage.ru_stime
+        _command['max_rss_bytes'] = rusage.ru_maxrss * MAXRSS_UNIT
+
+    with _LOCK:
+        _COMMANDS.append(_command)
+
+
+def run(name, func, profile_dir=None):
+    """Run a processor's 'func' as 'name' and time it, profiling it to 'profile_dir' if given."""
+    _LOCAL.processor = name
+    _start = time.perf_counter()
+
+    try:
+        if profile_dir:
+            result = _profile(name, func, profile_dir)
+        else:
+            result = func()
+    finally:
+        _LOCAL.processor = None
+
+        if _ENABLED:
+            with _LOCK:
+                _PROCESSORS[name] = time.perf_counter() - _start
+
+    return result
+
+
+def _profile(name, func, directory):
+    """Run 'func' with cProfile and tracemalloc, and write the results for processor 'name'."""
+    _profiler = cProfile.Profile()
+    _tracing = tracemalloc.is_tracing()
+
+    if not _tracing:
+        tracemalloc.start()
+
+    # Python 3.9 and later. Otherwise the peak is only accurate when tracing starts here.
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+    _before = tracemalloc.get_traced_memory()[0]
+
+    try:
+        result = _profiler.runcall(func)
+    finally:
+        _after, _peak = tracemalloc.get_traced_memory()
+
+        if not _tracing:
+            tracemalloc.stop()
+
+        _write_profile(name, _profiler, _peak - _before, _after - _before, directory)
+
+    return result
+
+
+def _write_profile(name, profiler, peak, retained, directory):
+    """Write '<name>.prof' cProfile stats, and a '<name>.txt' report with peak memory and the slowest functions."""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, '{}.prof'.format(name)))
+
+        with open(os.path.join(directory, '{}.txt'.format(name)), 'w') as _f:
+            _f.write('Peak memory: {} bytes\n'.format(peak))
+            _f.write('Retained memory: {} bytes\n\n'.format(retained))
+            pstats.Stats(profiler, stream=_f).sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+        LOG.info('%s: Profile written to %s, peak memory %s bytes.' % (name, directory, peak))
+    except OSError as e:
+        LOG.error('%s: Unable to write profile to %s - %s' % (name, directory, e))
+
+
+def summary():
+    """Log, clear and return the time taken by each processor and its steps, and by each command."""
+    with _LOCK:
+        _processors = dict(_PROCESSORS)
+        _steps = dict(_STEPS)
+        _commands = list(_COMMANDS)
+
+        _PROCESSORS.clear()
+        _STEPS.clear()
+        _COMMANDS.clear()
+
+    for _name, _seconds in sorted(_processors.items(), key=lambda _p: _p[1], reverse=True):
+        _step_times = ', '.join('%s %.3fs' % (_step, _s) for (_p, _step), _s in _steps.items() if _p == _name)
+        _count = len([_c for _c in _commands if _c['processor'] == _name])
+
+        LOG.info('%s: Took %.3fs, %s command(s)%s' % (_name, _seconds, _count,
+                                                      ' - {}'.format(_step_times) if _step_times else ''),
+                 extra={'processor': _name, 'seconds': _seconds, 'commands': _count,
+                        'steps': {_step: _s for (_p, _step), _s in _steps.items() if _p == _name}})
+
+    if _commands:
+        _slowest = sorted(_commands, key=lambda _c: _c['seconds'], reverse=True)[:SLOWEST]
+
+        LOG.info('Slowest commands: %s' % '; '.join('%s %.3fs (%s)' % (' '.join(_c['cmd']), _c['seconds'],
+                                                                          _c['processor'] or 'munkicon')
+                                                      for _c in _slowest))
+
+    result = {'processors': _processors, 'steps': _steps, 'commands': _commands}
+
+    return result
@@ -0,0 +1,116 @@
+"""Watch processor inputs for changes."""
+import logging
+import os
+import select
+import threading
+
+try:
+    import plist
+except ImportError:
+    from . import plist
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between checks of the inputs.
+POLL_INTERVAL = 2
+
+# Seconds to let writes in progress finish before processors read changed inputs.
+SETTLE = 1
+
+_VNODE_EVENTS = 0
+
+if hasattr(select, 'kqueue'):
+    _VNODE_EVENTS = (select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_ATTRIB |
+                     select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)
+
+
+class Watcher(object):
+    """Reports which processors' inputs have changed."""
+    def __init__(self, inputs, interval=POLL_INTERVAL, settle=SETTLE):
+        self._inputs = {_name: list(_paths) for _name, _paths in inputs.items() if _paths}
+        self._interval = interval
+        self._settle = settle
+        self._stop = threading.Event()
+        self._kqueue = None
+        self._wakeup = None
+        self._fingerprints = self._snapshot()
+
+        if _VNODE_EVENTS:
+            self._kqueue = select.kqueue()
+            self._wakeup = os.pipe()
+
+    @property
+    def processors(self):
+        """Names of the processors being watched."""
+        return sorted(self._inputs)
+
+    def _snapshot(self):
+        return {_path: plist.fingerprint(_path) for _paths in self._inputs.values() for _path in _paths}
+
+    def _changed(self, before, after):
+        return {_name for _name, _paths in self._inputs.items() if any(before.get(_p) != after.get(_p) for _p in _paths)}
+
+    def _wait(self):
+        """Wait until a watched path may have changed, the interval passes, or the watcher is stopped."""
+        if not self._kqueue:
+            self._stop.wait(self._interval)
+            return
+
+        # The directory containing each input is watched too, so inputs that are
+        # created or replaced are seen. Files are opened on each wait, as an atomic
+        # replace leaves a previously opened descriptor on the old file.
+        _fds = list()
+        _paths = {_p for _paths in self._inputs.values() for _p in _paths}
+        _paths.update({os.path.dirname(_p) for _p in _paths})
+
+        try:
+            for _path in _paths:
+                try:
+                    _fds.append(os.open(_path, getattr(os, 'O_EVTONLY', os.O_RDONLY)))
+                except OSError:
+                    pass
+
+            _events = [select.kevent(_fd, filter=select.KQ_FILTER_VNODE, flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                                     fflags=_VNODE_EVENTS) for _fd in _fds]
+            _events.append(select.kevent(self._wakeup[0], filter=select.KQ_FILTER_READ, flags=select.KQ_EV_ADD))
+            self._kqueue.control(_events, 1, self._interval)
+        finally:
+            for _fd in _fds:
+                os.close(_fd)
+
+    def changes(self):
+        """Yield the set of processors whose inputs have changed, until stopped."""
+        while not self._stop.is_set():
+            self._wait()
+
+            if self._stop.is_set():
+                break
+
+            _current = self._snapshot()
+            _changed = self._changed(self._fingerprints, _current)
+
+            if _changed:
+                self._stop.wait(self._settle)
+                _current = self._snapshot()
+                _changed.update(self._changed(self._fingerprints, _current))
+                self._fingerprints = _current
+
+                LOG.info('Inputs changed for: %s' % ', '.join(sorted(_changed)))
+                yield _changed
+
+    def stop(self, *args):
+        """Stop watching, for use as a signal handler."""
+        self._stop.set()
+
+        if self._wakeup:
+            os.write(self._wakeup[1], b'\0')
+
+    def close(self):
+        """Release the kqueue."""
+        if self._kqueue:
+            self._kqueue.close()
+
+            for _fd in self._wakeup:
+                os.close(_fd)
+
+            self._kqueue = None
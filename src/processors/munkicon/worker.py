@@ -4,18 +4,22 @@ import os
 import sys
 
 try:
+    import backend
     import plist
 except ImportError:
+    from . import backend
     from . import plist
 
 LOG = logging.getLogger(__name__)
 
 
 class MunkiConWorker(object):
-    """MunkiConWorker"""
+    """Aggregates conditions from all processors and writes them once."""
     def __init__(self, conditions_file='/Library/Managed Installs/ConditionalItems.plist', log_src=None):
         self._log_src = os.path.basename(log_src) if log_src else None
         self._conditions_file = conditions_file
+        self._conditions = dict()
+        self._sources = list()
 
         if not self._is_root():
             LOG.info('%s: Must be root to execute.' % self._log_src)
@@ -24,7 +28,8 @@ class MunkiConWorker(object):
     def _is_root(self):
         result = None
 
-        result = os.geteuid() == 0
+        # Replayed fixtures don't need root, as nothing on this Mac is read.
+        result = backend.replaying() or os.geteuid() == 0
 
         return result
 
@@ -37,20 +42,37 @@ class MunkiConWorker(object):
 
         return result
 
-    def write(self, conditions):
+    def update(self, conditions, log_src=None):
+        """Collect the conditions generated by a processor."""
+        _src = os.path.basename(log_src) if log_src else self._log_src
+
+        if conditions:
+            self._conditions.update(conditions)
+            self._sources.append(_src)
+            LOG.debug('%s: Conditions collected.' % _src)
+        else:
+            LOG.info('%s: No conditions collected.' % _src)
+
+    def write(self):
+        """Merge collected conditions into the existing conditions and write them, returning the write status."""
+        result = plist.FAILED
         _data = self._read_conditions()
 
         if not _data:
             _data = dict()
 
-        _data.update(conditions)
+        _data.update(self._conditions)
 
         try:
-            plist.writePlist(path=self._conditions_file, data=_data)
-
-            if _data:
-                LOG.info('%s: Conditions written.' % self._log_src)
-            elif not _data:
-                LOG.info('%s: No conditions written.' % self._log_src)
+            result = plist.writePlist(path=self._conditions_file, data=_data)
+
+            if not self._conditions:
+                LOG.info('No conditions written.')
+            elif result == plist.WRITTEN:
+                LOG.info('Conditions written for: %s' % ', '.join(self._sources))
+            elif result == plist.UNCHANGED:
+                LOG.info('Conditions unchanged for: %s' % ', '.join(self._sources))
         except Exception as e:
             LOG.error('%s' % e)
+
+        return result
@@ -0,0 +1,230 @@
+"""Minimal X.509 certificate decoder, for the fields munkicon needs without running openssl."""
+import base64
+import binascii
+import hashlib
+
+from collections import namedtuple
+from datetime import datetime, timezone
+
+PEM_BEGIN = '-----BEGIN CERTIFICATE-----'
+PEM_END = '-----END CERTIFICATE-----'
+
+# ASN.1 universal tags used in certificates.
+_INTEGER = 0x02
+_OID = 0x06
+_UTCTIME = 0x17
+_GENERALIZEDTIME = 0x18
+_SEQUENCE = 0x30
+_SET = 0x31
+_VERSION = 0xa0
+
+# Short names as used by OpenSSL when printing distinguished names. Any OID
+# not in this map is printed in dotted form, matching OpenSSL.
+_SHORT_NAMES = {'2.5.4.3': 'CN',
+                '2.5.4.4': 'SN',
+                '2.5.4.5': 'serialNumber',
+                '2.5.4.6': 'C',
+                '2.5.4.7': 'L',
+                '2.5.4.8': 'ST',
+                '2.5.4.9': 'street',
+                '2.5.4.10': 'O',
+                '2.5.4.11': 'OU',
+                '2.5.4.12': 'title',
+                '2.5.4.15': 'businessCategory',
+                '2.5.4.17': 'postalCode',
+                '2.5.4.42': 'GN',
+                '2.5.4.43': 'initials',
+                '2.5.4.44': 'generationQualifier',
+                '2.5.4.46': 'dnQualifier',
+                '2.5.4.65': 'pseudonym',
+                '2.5.4.97': 'organizationIdentifier',
+                '0.9.2342.19200300.100.1.1': 'UID',
+                '0.9.2342.19200300.100.1.25': 'DC',
+                '1.2.840.113549.1.9.1': 'emailAddress',
+                '1.3.6.1.4.1.311.60.2.1.1': 'jurisdictionL',
+                '1.3.6.1.4.1.311.60.2.1.2': 'jurisdictionST',
+                '1.3.6.1.4.1.311.60.2.1.3': 'jurisdictionC'}
+
+
+class X509Error(ValueError):
+    """Raised when a certificate can't be decoded."""
+    pass
+
+
+X509 = namedtuple('X509', ['not_before', 'not_after', 'subject', 'issuer', 'serial', 'sha1', 'sha256'])
+
+
+def _tlv(data, offset):
+    """Read the ASN.1 element at 'offset'. Returns (tag, value start, value end)."""
+    try:
+        _tag = data[offset]
+        _len = data[offset + 1]
+        offset += 2
+
+        if _len & 0x80:
+            _n = _len & 0x7f
+
+            if not _n or _n > 4:
+                raise X509Error('Unsupported length encoding')
+
+            _len = int.from_bytes(data[offset:offset + _n], 'big')
+            offset += _n
+    except IndexError:
+        raise X509Error('Truncated certificate')
+
+    if offset + _len > len(data):
+        raise X509Error('Truncated certificate')
+
+    return _tag, offset, offset + _len
+
+
+def _children(data, start, end):
+    """Yield (tag, value start, value end) for each element between start and end."""
+    while start < end:
+        _tag, _start, _end = _tlv(data, start)
+
+        yield _tag, _start, _end
+
+        start = _end
+
+
+def _expect(data, offset, tag):
+    """Read the element at 'offset' and check its tag."""
+    _tag, _start, _end = _tlv(data, offset)
+
+    if _tag != tag:
+        raise X509Error('Expected tag 0x{:02x}, found 0x{:02x}'.format(tag, _tag))
+
+    return _start, _end
+
+
+def _oid(value):
+    """Decode an OBJECT IDENTIFIER to dotted form."""
+    result = list()
+    _n = 0
+
+    for _b in value:
+        _n = (_n << 7) | (_b & 0x7f)
+
+        if not _b & 0x80:
+            if not result:
+                _first = min(_n // 40, 2)
+                result.extend([_first, _n - (_first * 40)])
+            else:
+                result.append(_n)
+
+            _n = 0
+
+    return '.'.join(str(_x) for _x in result)
+
+
+def _escape(value):
+    """Escape a name value the way OpenSSL does for the 'oneline' name format."""
+    return ''.join(chr(_b) if 0x20 <= _b <= 0x7e else '\\x{:02X}'.format(_b) for _b in value)
+
+
+def _name(data, start, end):
+    """Decode a Name to the OpenSSL 'oneline' format, for example '/C=US/O=Apple Inc./CN=Apple Root CA'."""
+    result = list()
+
+    for _set_tag, _set_start, _set_end in _children(data, start, end):
+        if _set_tag != _SET:
+            raise X509Error('Malformed name')
+
+        for _atv_tag, _atv_start, _atv_end in _children(data, _set_start, _set_end):
+            _oid_start, _oid_end = _expect(data, _atv_start, _OID)
+            _val_tag, _val_start, _val_end = _tlv(data, _oid_end)
+            _type = _oid(data[_oid_start:_oid_end])
+
+            result.append('/{}={}'.format(_SHORT_NAMES.get(_type, _type), _escape(data[_val_start:_val_end])))
+
+    return ''.join(result)
+
+
+def _time(tag, value):
+    """Decode a UTCTime or GeneralizedTime to a UTC datetime."""
+    try:
+        _value = value.decode('ascii').rstrip('Z')
+
+        if tag == _UTCTIME:
+            # RFC 5280: two digit years 50-99 are 19xx, 00-49 are 20xx.
+            _year = int(_value[:2])
+            _value = '{}{}'.format(1900 + _year if _year >= 50 else 2000 + _year, _value[2:])
+        elif tag != _GENERALIZEDTIME:
+            raise X509Error('Unsupported time type 0x{:02x}'.format(tag))
+
+        # Seconds are optional in UTCTime.
+        _fmt = '%Y%m%d%H%M%S' if len(_value) >= 14 else '%Y%m%d%H%M'
+        result = datetime.strptime(_value[:14], _fmt).replace(tzinfo=timezone.utc)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise X509Error('Malformed time: {}'.format(e))
+
+    return result
+
+
+def _serial_hex(value):
+    """Serial number as upper case hex, padded to whole bytes as OpenSSL prints it."""
+    result = '{:X}'.format(int.from_bytes(value, 'big'))
+
+    if len(result) % 2:
+        result = '0{}'.format(result)
+
+    return result
+
+
+def load_der(der):
+    """Decode a DER encoded certificate."""
+    _cert_start, _cert_end = _expect(der, 0, _SEQUENCE)
+    _tbs_start, _tbs_end = _expect(der, _cert_start, _SEQUENCE)
+    _fields = list(_children(der, _tbs_start, _tbs_end))
+
+    # The version is optional and explicitly tagged.
+    if _fields and _fields[0][0] == _VERSION:
+        _fields = _fields[1:]
+
+    if len(_fields) < 5:
+        raise X509Error('Malformed certificate')
+
+    _serial, _sig_alg, _issuer, _validity, _subject = _fields[:5]
+
+    if _serial[0] != _INTEGER or _validity[0] != _SEQUENCE:
+        raise X509Error('Malformed certificate')
+
+    _times = list(_children(der, _validity[1], _validity[2]))
+
+    if len(_times) != 2:
+        raise X509Error('Malformed validity')
+
+    result = X509(not_before=_time(_times[0][0], der[_times[0][1]:_times[0][2]]),
+                  not_after=_time(_times[1][0], der[_times[1][1]:_times[1][2]]),
+                  subject=_name(der, _subject[1], _subject[2]),
+                  issuer=_name(der, _issuer[1], _issuer[2]),
+                  serial=_serial_hex(der[_serial[1]:_serial[2]]),
+                  sha1=hashlib.sha1(der).hexdigest().upper(),
+                  sha256=hashlib.sha256(der).hexdigest().upper())
+
+    return result
+
+
+def pem_to_der(pem):
+    """Extract the DER bytes from a PEM encoded certificate."""
+    if isinstance(pem, bytes):
+        pem = pem.decode('ascii', errors='ignore')
+
+    _start = pem.find(PEM_BEGIN)
+    _end = pem.find(PEM_END, _start)
+
+    if _start == -1 or _end == -1:
+        raise X509Error('No PEM certificate found')
+
+    try:
+        result = base64.b64decode(''.join(pem[_start + len(PEM_BEGIN):_end].split()), validate=True)
+    except binascii.Error as e:
+        raise X509Error('Malformed PEM: {}'.format(e))
+
+    return result
+
+
+def load_pem(pem):
+    """Decode a PEM encoded certificate."""
+    return load_der(pem_to_der(pem))
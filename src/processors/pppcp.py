@@ -1,11 +1,15 @@
 import os
 
 try:
+    from munkicon import backend
     from munkicon import plist
-    from munkicon import worker
+    from munkicon import timing
+    from munkicon.orderedset import OrderedSet
 except ImportError:
+    from .munkicon import backend
     from .munkicon import plist
-    from .munkicon import worker
+    from .munkicon import timing
+    from .munkicon.orderedset import OrderedSet
 
 # Keys: 'tcc_accessibility'
 #       'tcc_address_book'
@@ -29,6 +33,10 @@ except ImportError:
 #       'tcc_removable_volumes'
 #       'tcc_sys_admin_files'
 
+# Cache conditions until the MDM overrides change.
+INPUTS = ['/Library/Application Support/com.apple.TCC/MDMOverrides.plist']
+MAX_AGE = None
+
 
 class PPPCPConditions(object):
     """PPPCP Profiles"""
@@ -59,6 +67,7 @@ class PPPCPConditions(object):
 
         return result
 
+    @timing.timed
     def _pppcp_overrides(self):
         """Returns PPPCP identifiers from MDM overrides."""
         result = dict()
@@ -88,14 +97,14 @@ class PPPCPConditions(object):
 
         # Generate the results keys to return.
         for _k, _v in _ktcc_map.items():
-            result[_v] = list()
+            result[_v] = OrderedSet()
 
-        _mdmoverrides = '/Library/Application Support/com.apple.TCC/MDMOverrides.plist'
+        _mdmoverrides = backend.path('/Library/Application Support/com.apple.TCC/MDMOverrides.plist')
 
         if os.path.exists(_mdmoverrides):
+            # Raise rather than return no overrides, which would be cached until the file changes.
             if not os.access(_mdmoverrides, os.R_OK):
-                LOG.error('%s does not appear readable. Make sure Full Disk Access is granted to the parent process/application.' % _mdmoverrides)
-                return result
+                raise PermissionError('%s does not appear readable. Make sure Full Disk Access is granted to the parent process/application.' % _mdmoverrides)
 
             _overrides = plist.readPlist(path=_mdmoverrides)
 
@@ -116,10 +125,7 @@ class PPPCPConditions(object):
 
                                 # Only add if there's an identifier
                                 if _ae_id and _auth and _id:
-                                    _tcc_str = '{},{},{}'.format(_auth, _id, _ae_id)
-
-                                    if _tcc_str not in result[_tcc_type]:
-                                        result[_tcc_type].append(_tcc_str)
+                                    result[_tcc_type].add('{},{},{}'.format(_auth, _id, _ae_id))
                         else:
                             _entry = self._parse_item(_v)
                             _ae_id = _entry.get('ae_identifier', None)
@@ -128,10 +134,7 @@ class PPPCPConditions(object):
 
                             # Only add if there's an identifier
                             if _auth and _id:
-                                _tcc_str = '{},{}'.format(_auth, _id)
-
-                                if _tcc_str not in result[_tcc_type]:
-                                    result[_tcc_type].append(_tcc_str)
+                                result[_tcc_type].add('{},{}'.format(_auth, _id))
 
         return result
 
@@ -144,8 +147,7 @@ class PPPCPConditions(object):
         return result
 
 
-def runner(dest):
+def runner():
     pppcp = PPPCPConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=pppcp.conditions)
+    return pppcp.conditions
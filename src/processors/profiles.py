@@ -1,42 +1,41 @@
-import subprocess
-
 try:
-    from munkicon import worker
+    from munkicon import executor
+    from munkicon import timing
+    from munkicon.orderedset import OrderedSet
 except ImportError:
-    from .munkicon import worker
+    from .munkicon import executor
+    from .munkicon import timing
+    from .munkicon.orderedset import OrderedSet
 
 # Keys: 'installed_profiles'
 
+# Conditions come from 'profiles' only, so are never cached.
+INPUTS = None
+MAX_AGE = None
+
 
 class Profiles():
     """Certificates."""
     def __init__(self):
         self.conditions = self._process()
 
+    @timing.timed
     def _find_certificates(self):
         """Find certificates and process dates.."""
-        result = {'installed_profiles': list()}
+        result = {'installed_profiles': OrderedSet()}
         _attr_str = 'attribute: name:'
 
         _cmd = ['/usr/bin/profiles', 'list', '-verbose']
+        _p = executor.run(_cmd)
 
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
-
-        if _p.returncode == 0 and _r:
-            if isinstance(_r, bytes):
-                _r = _r.decode('utf-8').strip()
-
-            for _l in _r.splitlines():
+        if _p.returncode == 0 and _p.out:
+            for _l in _p.out.splitlines():
                 _l = _l.strip()
 
                 if _attr_str in _l:
                     # Partition and get the last result which should be the action profile name.
                     try:
-                        _result = _l.partition(_attr_str)[-1].strip()
-
-                        if _result not in result['installed_profiles']:
-                            result['installed_profiles'].append(_result)
+                        result['installed_profiles'].add(_l.partition(_attr_str)[-1].strip())
                     except IndexError:
                         pass
 
@@ -51,8 +50,7 @@ class Profiles():
         return result
 
 
-def runner(dest):
+def runner():
     profiles = Profiles()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=profiles.conditions)
+    return profiles.conditions
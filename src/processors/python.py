@@ -1,10 +1,11 @@
-import os
-import subprocess
-
 try:
-    from munkicon import worker
+    from munkicon import backend
+    from munkicon import executor
+    from munkicon import timing
 except ImportError:
-    from .munkicon import worker
+    from .munkicon import backend
+    from .munkicon import executor
+    from .munkicon import timing
 
 # Keys: 'mac_os_python_path'
 #       'mac_os_python_ver'
@@ -14,12 +15,19 @@ except ImportError:
 #       'official_python3_path'
 #       'official_python3_ver'
 
+# Cache conditions until any of the interpreters change.
+INPUTS = ['/usr/bin/python',
+          '/usr/local/munki/munki-python',
+          '/usr/local/bin/python3']
+MAX_AGE = None
+
 
 class PythonConditions(object):
     """Generates information about python versions."""
     def __init__(self):
         self.conditions = self._process()
 
+    @timing.timed
     def _python_versions(self):
         """Gets the version of several Python paths (if they exist)."""
         result = {'mac_os_python_path': '',
@@ -32,8 +40,8 @@ class PythonConditions(object):
 
         _munki_pythons = ['/usr/local/munki/munki-python', '/usr/local/munki/munki-python']
 
-        if any([os.path.exists(_p) for _p in _munki_pythons]):
-            _munki_python = [_x for _x in _munki_pythons if os.path.exists(_x)][0]
+        if any([backend.exists(_p) for _p in _munki_pythons]):
+            _munki_python = [_x for _x in _munki_pythons if backend.exists(_x)][0]
         else:
             _munki_python = ''
 
@@ -41,9 +49,11 @@ class PythonConditions(object):
                          'munki_python_path': _munki_python,
                          'official_python3_path': '/usr/local/bin/python3'}
 
+        _versions = dict()
+
         for _k, _v in _python_paths.items():
-            if os.path.exists(_v):
-                _real_path = os.path.realpath(_v)
+            if backend.exists(_v):
+                _real_path = backend.realpath(_v)
                 result[_k] = _real_path
 
                 # Include the munki python symlink in use
@@ -54,26 +64,20 @@ class PythonConditions(object):
                 if _k == 'official_python3_path':
                     result['official_python3_symlink'] = _v
 
-                _cmd = [_real_path, '--version']
-
-                _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                _r, _e = _p.communicate()
-
-                if _p.returncode == 0:
-                    _ver = None
-
-                    if _r:
-                        if isinstance(_r, bytes):
-                            _r = _r.decode('utf-8').strip()
+                _versions[_k.replace('_path', '_ver')] = [_real_path, '--version']
 
-                        _ver = _r.replace('Python ', '')
-                    elif _e:
-                        if isinstance(_e, bytes):
-                            _e = _e.decode('utf-8').strip()
+        # Interpreters are independent, so check their versions all at once.
+        for _k, _p in zip(_versions, executor.run_all(_versions.values())):
+            if _p.returncode == 0:
+                _ver = None
 
-                        _ver = _e.replace('Python ', '')
+                # Python 2 prints its version to stderr.
+                if _p.out:
+                    _ver = _p.out.replace('Python ', '')
+                elif _p.err:
+                    _ver = _p.err.replace('Python ', '')
 
-                    result[_k.replace('_path', '_ver')] = _ver
+                result[_k] = _ver
 
         return result
 
@@ -86,8 +90,7 @@ class PythonConditions(object):
         return result
 
 
-def runner(dest):
+def runner():
     py = PythonConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=py.conditions)
+    return py.conditions
@@ -1,16 +1,22 @@
 import os
 
 try:
+    from munkicon import backend
     from munkicon import plist
-    from munkicon import worker
+    from munkicon import timing
 except ImportError:
+    from .munkicon import backend
     from .munkicon import plist
-    from .munkicon import worker
+    from .munkicon import timing
 
 # Keys: 'sys_ext_bundles'
 #       'sys_ext_teams'
 #       'sys_ext_team_bundle'
 
+# Cache conditions until the system extensions database changes.
+INPUTS = ['/Library/SystemExtensions/db.plist']
+MAX_AGE = None
+
 
 class SystemExtensionPolicyConditions(object):
     """Whitelisted System Extension's as applied by MDM or set by user."""
@@ -18,6 +24,7 @@ class SystemExtensionPolicyConditions(object):
 
         self.conditions = self._process()
 
+    @timing.timed
     def _sys_exts(self):
         """System Extensions."""
         result = {'sys_ext_teams': list(),
@@ -25,7 +32,7 @@ class SystemExtensionPolicyConditions(object):
                   'sys_ext_team_bundle': list(),
                   'sys_ext_types': list()}
 
-        _db_file = '/Library/SystemExtensions/db.plist'
+        _db_file = backend.path('/Library/SystemExtensions/db.plist')
         _sys_ext_teams = set()
         _sys_ext_bundles = set()
         _sys_ext_team_bundle = set()
@@ -34,10 +41,11 @@ class SystemExtensionPolicyConditions(object):
         if os.path.exists(_db_file):
             # Note, System Ext profiles do not have a payload key of allowed
             # Bundle ID's per https://developer.apple.com/documentation/devicemanagement/systemextensions
-            _ext_policies = plist.readPlist(path=_db_file)['extensionPolicies']
+            _db = plist.readPlist(path=_db_file)
+            _ext_policies = _db['extensionPolicies']
 
             # This appears to be where manually approved items exist.
-            _exts = plist.readPlist(path=_db_file)['extensions']
+            _exts = _db['extensions']
 
             # Policies managed by profiles
             for _policy in _ext_policies:
@@ -93,10 +101,10 @@ class SystemExtensionPolicyConditions(object):
                             _team_bundle_str = '{},{}'.format(_team_id, _bundle_id)
                             _sys_ext_team_bundle.add(_team_bundle_str)
 
-        result['sys_ext_teams'] = list(_sys_ext_teams)
-        result['sys_ext_bundles'] = list(_sys_ext_bundles)
-        result['sys_ext_team_bundle'] = list(_sys_ext_team_bundle)
-        result['sys_ext_types'] = list(_sys_ext_types)
+        result['sys_ext_teams'] = sorted(_sys_ext_teams)
+        result['sys_ext_bundles'] = sorted(_sys_ext_bundles)
+        result['sys_ext_team_bundle'] = sorted(_sys_ext_team_bundle)
+        result['sys_ext_types'] = sorted(_sys_ext_types)
 
         return result
 
@@ -109,8 +117,7 @@ class SystemExtensionPolicyConditions(object):
         return result
 
 
-def runner(dest):
+def runner():
     s_ext = SystemExtensionPolicyConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=s_ext.conditions)
+    return s_ext.conditions
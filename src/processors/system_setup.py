@@ -1,16 +1,19 @@
 import os
-import subprocess
-
-from pathlib import Path
 
 try:
+    from munkicon import backend
     from munkicon import common
-    from munkicon import worker
+    from munkicon import executor
     from munkicon import plist
+    from munkicon import timing
+    from munkicon.orderedset import OrderedSet
 except ImportError:
+    from .munkicon import backend
     from .munkicon import common
-    from .munkicon import worker
+    from .munkicon import executor
     from .munkicon import plist
+    from .munkicon import timing
+    from .munkicon.orderedset import OrderedSet
 
 # Keys: 'ard_enabled'
 #       'cups_web_interface_enabled'
@@ -27,48 +30,73 @@ except ImportError:
 #       'rosetta2_installed'
 #       'rosetta2_version'
 
+# Files backing values that would otherwise need a (slow) 'systemsetup' call.
+LAUNCHD_DISABLED = '/var/db/com.apple.xpc.launchd/disabled.plist'
+LOCALTIME = '/etc/localtime'
+NTP_CONF = '/etc/ntp.conf'
+TIMED_PREFS = ['/var/db/timed/Library/Preferences/com.apple.timed.plist',
+               '/Library/Preferences/com.apple.timed.plist']
+
+# Cache conditions until any of the files read directly change. Other values come
+# from commands, so refresh at least hourly. A command that fails raises CommandError
+# rather than giving empty values, so the last cached conditions are kept.
+INPUTS = [LAUNCHD_DISABLED, LOCALTIME, NTP_CONF] + TIMED_PREFS
+MAX_AGE = 3600
+
+CSRUTIL = ['/usr/bin/csrutil', 'status']
+CUPSCTL = ['/usr/sbin/cupsctl']
+MDMCLIENT = ['/usr/libexec/mdmclient', 'QuerySecurityInfo']
+ROSETTA_PKG_INFO = ['/usr/sbin/pkgutil', '--pkg-info-plist', 'com.apple.pkg.RosettaUpdateAuto']
+SYSTEMSETUP = '/usr/sbin/systemsetup'
+SYSTEMSETUP_VERBS = {'gettimezone': 'timezone',
+                     'getusingnetworktime': 'ntp_enabled',
+                     'getwakeonnetworkaccess': 'wake_on_lan',
+                     'getremotelogin': 'ssh_enabled',
+                     'getremoteappleevents': 'remote_apple_events_enabled'}
+
 
 class SystemSetupConditions(object):
     """SystemSetup conditions."""
-    def __init__(self):
-        self.conditions = self._process()
+    def __init__(self, root='/'):
+        # 'root' allows the files read directly to be read from a fixture directory.
+        self._root = root
+        self._direct = dict()
+        self._commands = executor.Batch(list())
 
-    def _arch(self):
-        """Internal arch check as some features not supported on Apple Silicon."""
-        result = None
-
-        _cmd = ['/usr/bin/arch']
+        self.conditions = self._process()
 
-        _p = subprocess.run(_cmd, capture_output=True, encoding='utf-8')
+    def _path(self, path):
+        """Path relative to the root being processed."""
+        return os.path.join(self._root, path.lstrip('/'))
 
-        if _p.returncode == 0:
-            result = _p.stdout.strip()
+    def _read_path(self, path):
+        """Where to read a file relative to the root from."""
+        return backend.path(self._path(path))
 
-        return result
+    def _arch(self):
+        """Internal arch check as some features not supported on Apple Silicon."""
+        return common.host_facts().arch
 
+    @timing.timed
     def _ard_state(self):
         """ARD State."""
         result = {'ard_enabled': ''}
 
-        _cmd = ['/usr/libexec/mdmclient', 'QuerySecurityInfo']
-
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
+        _p = self._commands.run(MDMCLIENT)
 
-        if _p.returncode == 0:
-            if _r:
-                if isinstance(_r, bytes):
-                    _r = _r.decode('utf-8').strip()
+        if _p.failed:
+            raise executor.CommandError(_p)
 
-                for _l in _r.splitlines():
-                    _l = _l.strip()
+        for _l in _p.out.splitlines():
+            _l = _l.strip()
 
-                    if 'RemoteDesktopEnabled' in _l:
-                        result['ard_enabled'] = '1' in _l
-                        break
+            if 'RemoteDesktopEnabled' in _l:
+                result['ard_enabled'] = '1' in _l
+                break
 
         return result
 
+    @timing.timed
     def _efi_password_state(self):
         """EFI Password State."""
         result = {'efi_password_enabled': '',
@@ -78,15 +106,15 @@ class SystemSetupConditions(object):
         if 'arm' not in _arch:
             _cmd = ['/usr/sbin/firmwarepasswd', '-check']
 
-            _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            _r, _e = _p.communicate()
+            _p = self._commands.run(_cmd)
 
-            if _p.returncode == 0:
-                if _r:
-                    if isinstance(_r, bytes):
-                        _r = _r.decode('utf-8').strip()
+            # Exits non-zero where there is no firmware password support.
+            if _p.timed_out:
+                raise executor.CommandError(_p)
 
-                    result['efi_password_enabled'] = 'Yes' in _r.split(': ')
+            if _p.returncode == 0:
+                if _p.out:
+                    result['efi_password_enabled'] = 'Yes' in _p.out.split(': ')
                     result['efi_password_supported'] = True
         elif 'arm' in _arch:
             result['efi_password_enabled'] = False
@@ -94,50 +122,90 @@ class SystemSetupConditions(object):
 
         return result
 
+    @timing.timed
     def _printer_state(self):
         """Printer State."""
         result = {'cups_web_interface_enabled': '',
                   'printer_sharing_enabled': ''}
 
-        _cmd = ['/usr/sbin/cupsctl']
+        _p = self._commands.run(CUPSCTL)
 
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
+        if _p.failed:
+            raise executor.CommandError(_p)
 
-        if _p.returncode == 0:
-            if _r:
-                if isinstance(_r, bytes):
-                    _r = _r.decode('utf-8').strip()
-
-                for _l in _r.splitlines():
-                    _l = _l.strip()
+        for _l in _p.out.splitlines():
+            _l = _l.strip()
 
-                    if '_share_printers' in _l:
-                        result['printer_sharing_enabled'] = '1' in _l
+            if '_share_printers' in _l:
+                result['printer_sharing_enabled'] = '1' in _l
 
-                    if 'WebInterface' in _l:
-                        result['cups_web_interface_enabled'] = 'Yes' in _l
+            if 'WebInterface' in _l:
+                result['cups_web_interface_enabled'] = 'Yes' in _l
 
         return result
 
+    @timing.timed
     def _sip_status(self):
         """SIP Status."""
         result = {'sip_enabled': ''}
 
-        _cmd = ['/usr/bin/csrutil', 'status']
+        _p = self._commands.run(CSRUTIL)
 
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
+        if _p.failed:
+            raise executor.CommandError(_p)
 
-        if _p.returncode == 0:
-            if _r:
-                if isinstance(_r, bytes):
-                    _r = _r.decode('utf-8').strip()
+        if _p.out:
+            result['sip_enabled'] = 'System Integrity Protection status: enabled' in _p.out
+
+        return result
 
-                result['sip_enabled'] = 'System Integrity Protection status: enabled' in _r
+    @timing.timed
+    def _timezone(self):
+        """Time zone from the '/etc/localtime' link target."""
+        result = None
+
+        try:
+            _target = backend.readlink(self._path(LOCALTIME))
+
+            if 'zoneinfo/' in _target:
+                result = _target.split('zoneinfo/', 1)[1]
+        except OSError:
+            pass
 
         return result
 
+    @timing.timed
+    def _network_time(self):
+        """Network time state from the 'timed' preferences."""
+        result = None
+
+        for _prefs in TIMED_PREFS:
+            _prefs = self._read_path(_prefs)
+
+            if os.path.exists(_prefs):
+                _value = (plist.readPlist(path=_prefs) or dict()).get('TMAutomaticTimeOnlyEnabled')
+
+                if isinstance(_value, bool):
+                    result = _value
+                    break
+
+        return result
+
+    @timing.timed
+    def _launchd_enabled(self, label):
+        """Service state from the launchd disabled overrides database, or None without an override."""
+        result = None
+        _disabled = self._read_path(LAUNCHD_DISABLED)
+
+        if os.path.exists(_disabled):
+            _value = (plist.readPlist(path=_disabled) or dict()).get(label)
+
+            if isinstance(_value, bool):
+                result = not _value
+
+        return result
+
+    @timing.timed
     def _systemsetup(self):
         """System Setup."""
         result = {'ntp_enabled': '',
@@ -147,50 +215,42 @@ class SystemSetupConditions(object):
                   'timezone': '',
                   'wake_on_lan': ''}
 
-        _verbs = {'gettimezone': 'timezone',
-                  'getusingnetworktime': 'ntp_enabled',
-                  'getwakeonnetworkaccess': 'wake_on_lan',
-                  'getremotelogin': 'ssh_enabled',
-                  'getremoteappleevents': 'remote_apple_events_enabled'}
-
         # The '-getnetworktimeserver' systemsetup argument only returns the first
         # ntp server found in the '/etc/ntp.conf' file, so read it directly if it exists.
-        _ntp_servers = list()
-        _ntp_conf = '/etc/ntp.conf'
+        _ntp_servers = OrderedSet()
+        _ntp_conf = self._read_path(NTP_CONF)
 
         if os.path.exists(_ntp_conf):
             with open(_ntp_conf, 'r') as _f:
                 _lines = _f.readlines()
 
                 if _lines:
+                    # Maintain the order of servers read, and exclude duplicates
                     for _l in _lines:
-                        _srv = _l.strip().replace('server ', '')
-
-                        # Maintain the order of servers read, and exclude duplicates
-                        if _srv not in _ntp_servers:
-                            _ntp_servers.append(_l.strip().replace('server ', ''))
+                        _ntp_servers.add(_l.strip().replace('server ', ''))
 
         # Use 'systemsetup' for simple system details
-        for _k, _v in _verbs.items():
-            _cmd = ['/usr/sbin/systemsetup', '-{}'.format(_k)]
+        for _k, _v in SYSTEMSETUP_VERBS.items():
+            if self._direct.get(_v) is not None:
+                result[_v] = self._direct[_v]
+                continue
 
-            _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            _r, _e = _p.communicate()
+            _p = self._commands.run([SYSTEMSETUP, '-{}'.format(_k)])
 
-            if _p.returncode == 0:
-                if _r:
-                    if isinstance(_r, bytes):
-                        _r = _r.decode('utf-8').strip()
+            if _p.failed:
+                raise executor.CommandError(_p)
 
-                    if _k not in ['gettimezone', 'getnetworktimeserver']:
-                        result[_v] = 'On' in _r.split(': ')[1:]
-                    elif _k == 'gettimezone':
-                        result[_v] = _r.split(': ')[1]
+            if _p.out:
+                if _k not in ['gettimezone', 'getnetworktimeserver']:
+                    result[_v] = 'On' in _p.out.split(': ')[1:]
+                elif _k == 'gettimezone':
+                    result[_v] = _p.out.split(': ')[1]
 
         result['ntp_servers'] = _ntp_servers
 
         return result
 
+    @timing.timed
     def _rosetta2_state(self):
         """Rosetta 2 state."""
         result = {'rosetta2_installed': False}
@@ -205,24 +265,26 @@ class SystemSetupConditions(object):
                         'oahd-helper',
                         'oahd-root-helper']
 
-        result['rosetta2_installed'] = all([Path(_rosetta_prefix).joinpath(_f).exists() for _f in _file_checks])
+        result['rosetta2_installed'] = all([backend.exists(os.path.join(_rosetta_prefix, _f)) for _f in _file_checks])
 
         return result
 
-    def _rosetta2_version(self, bundle_id='com.apple.pkg.RosettaUpdateAuto'):
+    @timing.timed
+    def _rosetta2_version(self):
         """Rosetta 2 version."""
         result = {'rosetta2_version': ''}
         _ver = ''
 
-        _cmd = ['/usr/sbin/pkgutil', '--pkg-info-plist', bundle_id]
+        _p = self._commands.run(ROSETTA_PKG_INFO)
 
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
+        # Exits non-zero when Rosetta 2 isn't installed.
+        if _p.timed_out:
+            raise executor.CommandError(_p)
 
         if _p.returncode == 0:
-            if _r:
+            if _p.stdout:
                 try:
-                    _ver = plist.readPlistFromString(obj=_r)['pkg-version']
+                    _ver = plist.readPlistFromString(obj=_p.stdout)['pkg-version']
                 except KeyError:
                     pass
 
@@ -234,6 +296,19 @@ class SystemSetupConditions(object):
         """Process all conditions and generate the condition dictionary."""
         result = dict()
 
+        # 'systemsetup' is slow to start, so read values from their backing files where
+        # possible. Anything that can't be determined (None) falls back to 'systemsetup'.
+        self._direct = {'timezone': self._timezone(),
+                        'ntp_enabled': self._network_time(),
+                        'ssh_enabled': self._launchd_enabled('com.openssh.sshd'),
+                        'remote_apple_events_enabled': self._launchd_enabled('com.apple.AEServer')}
+
+        # The remaining commands are independent, so start them all at once.
+        _cmds = [MDMCLIENT, CUPSCTL, CSRUTIL, ROSETTA_PKG_INFO]
+        _cmds.extend([SYSTEMSETUP, '-{}'.format(_k)] for _k, _v in SYSTEMSETUP_VERBS.items()
+                     if self._direct.get(_v) is None)
+        self._commands = executor.Batch(_cmds)
+
         result.update(self._ard_state())
         result.update(self._efi_password_state())
         result.update(self._printer_state())
@@ -245,8 +320,7 @@ class SystemSetupConditions(object):
         return result
 
 
-def runner(dest):
+def runner():
     se = SystemSetupConditions()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=se.conditions)
+    return se.conditions
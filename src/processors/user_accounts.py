@@ -1,152 +1,189 @@
-import subprocess
-
-from distutils.version import StrictVersion
-from platform import mac_ver
-
 try:
+    from munkicon import common
+    from munkicon import executor
     from munkicon import plist
-    from munkicon import worker
+    from munkicon import timing
 except ImportError:
+    from .munkicon import common
+    from .munkicon import executor
     from .munkicon import plist
-    from .munkicon import worker
+    from .munkicon import timing
 
 # Keys: 'user_home_path'
 #       'secure_token'
 #       'volume_owners'
 
+# Cache conditions until local user records change, refreshing at least hourly
+# for changes to SecureToken and volume ownership. A command that fails raises
+# CommandError rather than giving empty values, so the last cached conditions are kept.
+INPUTS = ['/var/db/dslocal/nodes/Default/users']
+MAX_AGE = 3600
+
+DSCL_USERS = ['/usr/bin/dscl', '-plist', '.', '-readall', '/Users', 'RecordName', 'NFSHomeDirectory', 'GeneratedUID']
+DISKUTIL_USERS = ['/usr/sbin/diskutil', 'apfs', 'listUsers', '/', '-plist']
+
 
 class UserAccounts(object):
     def __init__(self):
+        # User records and crypto users are independent, so read them at the same time.
+        self._commands = executor.Batch([DSCL_USERS, DISKUTIL_USERS])
+        self._records = self._read_users()
+        self._crypto_users = self._apfs_crypto_users()
+
         self.conditions = self._process()
 
-    def _users(self):
-        """Users."""
-        result = set()
+    @timing.timed
+    def _read_users(self):
+        """Local user records from a single 'dscl' call, keyed by record name."""
+        result = dict()
 
         _ignore_users = ['daemon',
                          'nobody',
                          'root']
 
-        _cmd = ['/usr/bin/dscl', '.', '-list', '/Users']
+        _p = self._commands.run(DSCL_USERS)
+
+        if _p.failed:
+            raise executor.CommandError(_p)
 
-        _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _r, _e = _p.communicate()
+        if _p.stdout:
+            try:
+                _records = plist.readPlistFromString(_p.stdout)
+            except Exception:
+                _records = list()
 
-        if _p.returncode == 0:
-            if isinstance(_r, bytes):
-                _r = _r.decode('utf-8').strip()
+            for _record in _records:
+                try:
+                    _u = _record['dsAttrTypeStandard:RecordName'][0]
+                except (KeyError, IndexError):
+                    continue
 
-            for _u in _r.splitlines():
                 if not _u.startswith('_'):
                     if _u not in _ignore_users:
-                        result.add(_u)
+                        result[_u] = _record
 
         return result
 
+    def _attribute(self, user, attr):
+        """First value of a user record attribute."""
+        result = None
+
+        try:
+            result = self._records[user]['dsAttrTypeStandard:{}'.format(attr)][0].strip()
+        except (KeyError, IndexError, AttributeError):
+            pass
+
+        return result
+
+    def _users(self):
+        """Users."""
+        return set(self._records)
+
+    @timing.timed
     def _home_dirs(self):
         """Home Directories"""
         result = {'user_home_path': list()}
 
-        _users = self._users()
-
         _home_dirs = set()
 
-        if _users:
-            for _u in _users:
-                _cmd = ['/usr/bin/dscl', '-plist', '.', '-read', '/Users/{}'.format(_u), 'NFSHomeDirectory']
+        for _u in self._users():
+            _h = self._attribute(_u, 'NFSHomeDirectory')
 
-                _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                _r, _e = _p.communicate()
+            if _h:
+                _home_dirs.add('{},{}'.format(_u, _h))
 
-                if _p.returncode == 0:
-                    if isinstance(_r, bytes):
-                        _r = _r.decode('utf-8').strip()
+        result['user_home_path'] = sorted(_home_dirs)
 
-                    if _r:
-                        _h = plist.readPlistFromString(_r)['dsAttrTypeStandard:NFSHomeDirectory']
+        return result
 
-                        if _h:
-                            try:
-                                _r = '{},{}'.format(_u, _h[0].strip())
-                            except IndexError:
-                                _r = '{},{}'.format(_u, _h.strip())
+    @timing.timed
+    def _apfs_crypto_users(self):
+        """APFS crypto users of the boot volume from a single 'diskutil' call, or None if unknown."""
+        result = None
 
-                            _home_dirs.add(_r)
+        _p = self._commands.run(DISKUTIL_USERS)
 
-        result['user_home_path'] = list(_home_dirs)
+        if _p.returncode == 0 and _p.stdout:
+            try:
+                result = plist.readPlistFromString(_p.stdout.strip())['Users']
+            except Exception:
+                pass
+
+        return result
+
+    def _sysadminctl_secure_tokens(self, users):
+        """SecureToken status for each user from 'sysadminctl', run for all users at once."""
+        result = dict()
+        _cmds = [['/usr/sbin/sysadminctl', '-secureTokenStatus', _u] for _u in users]
+
+        for _u, _p in zip(users, executor.run_all(_cmds)):
+            if _p.failed:
+                raise executor.CommandError(_p)
+
+            # Output is on stderr, not stdout
+            result[_u] = 'ENABLED' in _p.err
 
         return result
 
+    @timing.timed
     def _secure_tokens(self):
         """Determine SecureToken status for user."""
         result = {'secure_token': list()}
 
         _users = self._users()
 
-        if _users and StrictVersion(mac_ver()[0]) >= StrictVersion('10.14'):
-            for _u in _users:
-                _status = 'DISABLED'
-                _cmd = ['/usr/sbin/sysadminctl', '-secureTokenStatus', _u]
+        if _users and common.os_version() >= common.vers_convert('10.14'):
+            # Users holding a SecureToken are the 'LocalOpenDirectory' crypto users of the boot
+            # volume, matched on GUID. 'sysadminctl' is only run for users that can't be matched.
+            _token_uuids = {_c.get('APFSCryptoUserUUID') for _c in self._crypto_users or list()
+                            if _c.get('APFSCryptoUserType') == 'LocalOpenDirectory'}
 
-                _p = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                _r, _e = _p.communicate()
+            _guids = {_u: self._attribute(_u, 'GeneratedUID') for _u in _users}
+            _fallback = self._sysadminctl_secure_tokens(sorted(_u for _u, _g in _guids.items()
+                                                               if self._crypto_users is None or not _g))
 
-                if _p.returncode == 0:
-                    # Output is on stderr, not stdout
-                    if isinstance(_e, bytes):
-                        _e = _e.decode('utf-8').strip()
-
-                    if 'ENABLED' in _e:
-                        _status = 'ENABLED'
-
-                        result['secure_token'].append('{},{}'.format(_u, _status))
+            for _u in sorted(_users):
+                if _u in _fallback:
+                    _enabled = _fallback[_u]
                 else:
-                    pass
+                    _enabled = _guids[_u] in _token_uuids
+
+                if _enabled:
+                    result['secure_token'].append('{},{}'.format(_u, 'ENABLED'))
 
         return result
 
     def _user_guids(self):
         result = dict()
-        _users = self._users()
 
-        for _user in _users:
-            _cmd = ['/usr/bin/dscl', '.', '-read', f'/Users/{_user}', 'GeneratedUID']
-            _p = subprocess.run(_cmd, capture_output=True, encoding='utf-8')
+        for _user in self._users():
+            _uid = self._attribute(_user, 'GeneratedUID')
 
-            if _p.returncode == 0 and _p.stdout:
-                _uid = _p.stdout.strip().replace('GeneratedUID: ', '')
+            if _uid:
                 result[_uid] = _user
 
         return result
 
+    @timing.timed
     def _volume_owners(self):
         """Determine volume owners on APFS disks"""
         result = {'volume_owners': list()}
         _users_with_uid = self._user_guids()
         _vol_own_users = set()
 
-        _cmd = ['/usr/sbin/diskutil', 'apfs', 'listUsers', '/', '-plist']
-        _p = subprocess.run(_cmd, capture_output=True)
-
-        if _p.returncode == 0 and _p.stdout:
-            try:
-                _users = plist.readPlistFromString(_p.stdout.strip())['Users']
-
-                for _user in _users:
-                    _apfs_crypto_type = _user.get('APFSCryptoUserType')
-                    _apfs_crypto_uuid = _user.get('APFSCryptoUserUUID')
-                    _is_volume_owner = _user.get('VolumeOwner')
-                    _hr_user_name = _users_with_uid.get(_apfs_crypto_uuid)
+        for _user in self._crypto_users or list():
+            _apfs_crypto_type = _user.get('APFSCryptoUserType')
+            _apfs_crypto_uuid = _user.get('APFSCryptoUserUUID')
+            _is_volume_owner = _user.get('VolumeOwner')
+            _hr_user_name = _users_with_uid.get(_apfs_crypto_uuid)
 
-                    # When MDMRecovery exists as a crypto type, there is no human readable username that
-                    # correlates, so indicate MDMRecovery user manually
-                    if not _hr_user_name and _apfs_crypto_type and _apfs_crypto_type == 'MDMRecovery':
-                        _hr_user_name = 'MDMRecovery'
+            # When MDMRecovery exists as a crypto type, there is no human readable username that
+            # correlates, so indicate MDMRecovery user manually
+            if not _hr_user_name and _apfs_crypto_type and _apfs_crypto_type == 'MDMRecovery':
+                _hr_user_name = 'MDMRecovery'
 
-                    if _is_volume_owner and _apfs_crypto_type and _apfs_crypto_type != 'PersonalRecovery' and _hr_user_name:
-                        _vol_own_users.add(_hr_user_name)
-            except Exception:
-                pass
+            if _is_volume_owner and _apfs_crypto_type and _apfs_crypto_type != 'PersonalRecovery' and _hr_user_name:
+                _vol_own_users.add(_hr_user_name)
 
         result['volume_owners'] = sorted(list(_vol_own_users))
 
@@ -163,8 +200,7 @@ class UserAccounts(object):
         return result
 
 
-def runner(dest):
+def runner():
     users = UserAccounts()
-    mc = worker.MunkiConWorker(conditions_file=dest, log_src=__file__)
 
-    mc.write(conditions=users.conditions)
+    return users.conditions